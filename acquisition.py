@@ -0,0 +1,131 @@
+# -------------------------------------------------------------------------------
+#  Acquisition worker - polls the power supply off the GUI thread
+# -------------------------------------------------------------------------------
+
+import time
+from PyQt5 import QtCore
+from PyQt5.QtCore import pyqtSignal, pyqtSlot
+from broker import PRIORITY_MONITOR
+from metrics import METRICS
+from remote import PollFailures
+
+
+class AcquisitionWorker(QtCore.QObject):
+    """Opens the supplies and polls them from its own QThread.
+
+    resource is one VISA resource or several separated by ',', they are opened
+    concurrently as a Fleet. Every supply gets a DeviceBroker, which every
+    other user of the supplies has to go through as well. Every poll measures
+    all channels of the fleet, one compound query per supply and all supplies in
+    parallel, and emits a timestamped sample
+    (time.time(), {channel id: (voltage, current)}) so the GUI only has to
+    draw, never to wait on VISA round-trips.
+    """
+    started = pyqtSignal(str)
+    sample = pyqtSignal(float, object)
+    failed = pyqtSignal(str)
+    # number of failed polls before the supplies answered again
+    recovered = pyqtSignal(int)
+    stopped = pyqtSignal()
+
+    def __init__(self, resource, interval=10, log=None):
+        super().__init__()
+        self.resource = resource
+        self.interval = interval  # ms
+        # datalog.DataLog, samples then include the output states
+        self.log = log
+        self.paused = False
+        self.fleet = None
+        self.timer = None
+        self.failures = PollFailures()
+
+    @pyqtSlot()
+    def start(self):
+        # runs in the worker thread, so the connections and the timer live there too.
+        # The driver (dcps, pyvisa) is imported here on the first connect instead of at startup
+        from fleet import Fleet
+        fleet = Fleet(self.resource, self.log)
+        try:
+            idns = fleet.connect()
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        self.fleet = fleet
+        self.timer = QtCore.QTimer()
+        self.timer.setTimerType(QtCore.Qt.PreciseTimer)
+        self.timer.setInterval(self.interval)
+        self.timer.timeout.connect(self.poll)
+        self.timer.start()
+        self.started.emit('; '.join(idns))
+
+    @pyqtSlot()
+    def poll(self):
+        interval = round(self.failures.interval(self.interval / 1000.) * 1000)
+        if self.timer.interval() != interval:
+            self.timer.setInterval(interval)
+        if self.paused or self.fleet is None:
+            return
+        start = time.perf_counter()
+        try:
+            t = time.time()
+            # None for all channels of the fleet
+            values = self.fleet.call('measureAll', None, self.log is not None, priority=PRIORITY_MONITOR)
+        except Exception as e:
+            message = self.failures.failed(e)
+            if message is not None:
+                self.failed.emit(message)
+            return
+        count = self.failures.succeeded()
+        if count:
+            self.recovered.emit(count)
+            self.timer.setInterval(self.interval)
+        if self.log is not None:
+            self.log.samples(t, values)
+        self.sample.emit(t, values)
+        if METRICS.enabled:
+            cost = time.perf_counter() - start
+            METRICS.record('acquisition.poll', cost)
+            if cost > self.interval / 1000.:
+                METRICS.overrun('acquisition.poll')
+
+    @pyqtSlot()
+    def stop(self):
+        if self.timer is not None:
+            self.timer.stop()
+            self.timer = None
+        if self.fleet is not None:
+            # self.supply.outputOffAll()
+            self.fleet.disconnect()
+            self.fleet = None
+        self.stopped.emit()
+
+    def setInterval(self, interval):
+        # picked up by the worker thread on its next poll
+        self.interval = int(interval)
+
+    def setPaused(self, paused):
+        self.paused = paused
+
+
+class Acquisition(QtCore.QObject):
+    """Runs an AcquisitionWorker in a dedicated QThread."""
+
+    def __init__(self, resource, interval=10, log=None, parent=None):
+        super().__init__(parent)
+        self.thread = QtCore.QThread()
+        self.worker = AcquisitionWorker(resource, interval, log)
+        self.worker.moveToThread(self.thread)
+        self.thread.started.connect(self.worker.start)
+
+    @property
+    def fleet(self):
+        return self.worker.fleet
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        if self.thread.isRunning():
+            QtCore.QMetaObject.invokeMethod(self.worker, 'stop', QtCore.Qt.BlockingQueuedConnection)
+            self.thread.quit()
+            self.thread.wait()
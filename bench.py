@@ -0,0 +1,282 @@
+# -------------------------------------------------------------------------------
+#  Benchmarks - the headless service end to end against a simulated supply
+# -------------------------------------------------------------------------------
+#
+#  python bench.py [--resource SIM::...] [--output results.json] [--compare old.json]
+#
+#  Runs ControlService in a thread with its own event loop and drives it
+#  through the remote command protocol like a real client would:
+#
+#  samplerate  achieved acquisition rate and interval percentiles per interval
+#  ramp        write time error of a smooth ramp (RampExecutor.report)
+#  latency     command round trip p50/p99 with 1..N concurrent clients
+#  memory      RSS growth over a soak run with streaming subscribers
+#  metrics     the service's own timers (metrics.py) over all of the above
+#
+#  Results are stored as JSON, --compare prints the change of every number
+#  against an earlier result file.
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+import numpy as np
+from commands import UNKNOWN, BADARGS, FAILED
+from headless import ControlService, HISTORY
+from metrics import METRICS
+
+RESOURCE = 'SIM::bench?latency=0.001&jitter=0.0002'
+HOST = '127.0.0.1'
+PORT = 65440
+INTERVALS = (10, 5, 2, 1)  # ms
+CLIENTS = (1, 4, 16)
+ERRORS = tuple(bytes(tag, 'utf-8') for tag in (UNKNOWN, BADARGS, FAILED))
+# mixed load of the latency clients, one after another
+COMMANDS = ('get_curr:1', 'get_volt:2', 'set_current:3,0.1', 'get_samples:1,100')
+
+
+class ServiceThread:
+    """ControlService.serve on a background event loop"""
+
+    def __init__(self, resource, host=HOST, port=PORT):
+        self.service = ControlService(resource, logdir='')
+        self.host = host
+        self.port = port
+        self.loop = asyncio.new_event_loop()
+        self.task = None
+        self.thread = threading.Thread(target=self.run, name='Service', daemon=True)
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.task = self.loop.create_task(self.service.serve(self.host, self.port))
+        try:
+            self.loop.run_until_complete(self.task)
+        except asyncio.CancelledError:
+            pass
+
+    def start(self, timeout=10.):
+        self.thread.start()
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                asyncio.run(command(self.host, self.port, 'list_supplies'))
+                return
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError('service did not start')
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.task.cancel)
+        self.thread.join()
+
+
+async def command(host, port, *lines):
+    reader, writer = await asyncio.open_connection(host, port)
+    replies = []
+    for line in lines:
+        writer.write(bytes(line + '\n', 'utf-8'))
+        reply = await reader.readline()
+        if reply.startswith(ERRORS):
+            raise RuntimeError('{}: {}'.format(line, reply.decode().strip()))
+        replies.append(reply.decode().strip())
+    writer.close()
+    return replies
+
+
+def percentiles(values, scale=1.):
+    values = np.asarray(values) * scale
+    if not len(values):
+        return {}
+    return {'mean': float(values.mean()), 'p50': float(np.percentile(values, 50)),
+            'p99': float(np.percentile(values, 99)), 'max': float(values.max())}
+
+
+def rss():
+    # resident set size in bytes
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def samplerate(bench, duration):
+    service = bench.service
+    channel = service.channels[0]
+    results = {}
+    for interval in INTERVALS:
+        asyncio.run(command(bench.host, bench.port, 'set_acquisitioninterval:{}'.format(interval)))
+        time.sleep(0.2)
+        t0 = time.time()
+        time.sleep(duration)
+        t, _, _ = service.samples.buffer.tail(channel, HISTORY)
+        t = t[t >= t0]
+        dt = np.diff(t)
+        results[str(interval)] = {'target_hz': 1000. / interval,
+                                  'achieved_hz': float((len(t) - 1) / (t[-1] - t[0])) if len(t) > 1 else 0.,
+                                  'interval_ms': percentiles(dt, 1000.),
+                                  'late': int(np.count_nonzero(dt > 1.5 * interval / 1000.))}
+    asyncio.run(command(bench.host, bench.port, 'set_acquisitioninterval:10'))
+    return results
+
+
+def ramp(bench, dwell=10, target=1.0, rate=60.):
+    lines = ['set_channel:1', 'set_output:1,1', 'set_current:1,0', 'set_smoothtarget:{}'.format(target),
+             'set_smoothrate:{}'.format(rate), 'set_smoothdwell:{}'.format(dwell)]
+    asyncio.run(command(bench.host, bench.port, *lines))
+    time.sleep(0.5)
+    asyncio.run(command(bench.host, bench.port, 'start_smoothramp'))
+    bench.service.ramp.wait()
+    report = bench.service.ramp.report()
+    asyncio.run(command(bench.host, bench.port, 'set_current:1,0', 'set_output:1,0'))
+    return report
+
+
+async def client(host, port, duration, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    deadline = time.perf_counter() + duration
+    i = 0
+    while time.perf_counter() < deadline:
+        line = COMMANDS[i % len(COMMANDS)]
+        t = time.perf_counter()
+        writer.write(bytes(line + '\n', 'utf-8'))
+        reply = await reader.readline()
+        latencies[line].append(time.perf_counter() - t)
+        if reply.startswith(ERRORS):
+            errors.append(reply)
+        i += 1
+    writer.close()
+
+
+async def clients(host, port, n, duration):
+    latencies, errors = {line: [] for line in COMMANDS}, []
+    await asyncio.gather(*(client(host, port, duration, latencies, errors) for _ in range(n)))
+    return latencies, errors
+
+
+def latency(bench, duration):
+    # per command, a slow command holds up the commands after it on the same connection
+    results = {}
+    for n in CLIENTS:
+        latencies, errors = asyncio.run(clients(bench.host, bench.port, n, duration))
+        count = sum(len(v) for v in latencies.values())
+        results[str(n)] = dict(percentiles(np.concatenate(list(latencies.values())), 1000.),
+                               commands=count, errors=len(errors), throughput=count / duration,
+                               **{line: percentiles(v, 1000.) for line, v in latencies.items()})
+    return results
+
+
+async def subscriber(host, port, stop, counts, binary):
+    reader, writer = await asyncio.open_connection(host, port)
+    if binary:
+        writer.write(b'binary:1\n')
+    writer.write(b'subscribe:1+2+3,100\n')
+    received = 0
+    while not stop.is_set():
+        try:
+            received += len(await asyncio.wait_for(reader.read(65536), 0.5))
+        except asyncio.TimeoutError:
+            pass
+    counts.append(received)
+    writer.close()
+
+
+async def historian(host, port, stop):
+    reader, writer = await asyncio.open_connection(host, port)
+    while not stop.is_set():
+        writer.write(b'get_history:1,-10,0,200,mean\n')
+        await reader.readline()
+        await asyncio.sleep(0.1)
+    writer.close()
+
+
+def memory(bench, duration, subscribers=4):
+    samples = []
+    stop = threading.Event()
+    counts = []
+
+    async def load():
+        tasks = [subscriber(bench.host, bench.port, stop, counts, i % 2) for i in range(subscribers)]
+        tasks.append(historian(bench.host, bench.port, stop))
+        await asyncio.gather(*tasks)
+
+    loader = threading.Thread(target=asyncio.run, args=(load(),), daemon=True)
+    loader.start()
+    t0 = time.monotonic()
+    while time.monotonic() - t0 < duration:
+        samples.append((time.monotonic() - t0, rss()))
+        time.sleep(1.)
+    stop.set()
+    loader.join()
+    t, m = np.asarray(samples).T
+    # growth after the first tenth, when buffers have been allocated
+    steady = t >= duration / 10
+    slope = np.polyfit(t[steady], m[steady], 1)[0] if np.count_nonzero(steady) > 1 else 0.
+    return {'duration': duration, 'rss_start_mb': m[0] / 2 ** 20, 'rss_end_mb': m[-1] / 2 ** 20,
+            'rss_peak_mb': m.max() / 2 ** 20, 'growth_mb_per_hour': float(slope * 3600 / 2 ** 20),
+            'streamed_bytes': int(sum(counts))}
+
+
+def flatten(results, prefix=''):
+    # {'a': {'b': 1}} -> {'a.b': 1} for the numbers only
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(old, new):
+    old, new = flatten(old), flatten(new)
+    for key in sorted(new):
+        if key in old:
+            change = (new[key] - old[key]) / abs(old[key]) * 100 if old[key] else 0.
+            print('{:50s} {:14.6g} {:14.6g} {:+8.1f}%'.format(key, old[key], new[key], change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the headless service against a simulated supply')
+    parser.add_argument('--resource', default=RESOURCE)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--duration', type=float, default=5., help='seconds per sample rate and latency run')
+    parser.add_argument('--soak', type=float, default=60., help='seconds of the memory run, 0 to skip')
+    parser.add_argument('--output', default=time.strftime('bench-%Y%m%d-%H%M%S.json'))
+    parser.add_argument('--compare', help='earlier result file')
+    args = parser.parse_args()
+
+    bench = ServiceThread(args.resource, port=args.port)
+    bench.start()
+    results = {'time': time.time(), 'resource': args.resource, 'python': sys.version.split()[0],
+               'platform': platform.platform(), 'cpus': os.cpu_count()}
+    try:
+        print('Sample rate ...')
+        results['samplerate'] = samplerate(bench, args.duration)
+        print('Ramp ...')
+        results['ramp'] = ramp(bench)
+        print('Latency ...')
+        results['latency'] = latency(bench, args.duration)
+        if args.soak > 0:
+            print('Memory ...')
+            results['memory'] = memory(bench, args.soak)
+        # where the time went, over all runs
+        results['metrics'] = METRICS.snapshot()
+    finally:
+        bench.stop()
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print('Results written to', args.output)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+# -------------------------------------------------------------------------------
+#  Device broker - serializes every SCPI operation on one supply connection
+# -------------------------------------------------------------------------------
+
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from metrics import METRICS
+from logconfig import getlogger
+
+log = getlogger('datalog')
+
+# Lower number = served first
+PRIORITY_RAMP = 0
+PRIORITY_CONTROL = 1
+PRIORITY_MONITOR = 2
+
+# Side-effect free queries, identical ones waiting in the queue are answered once
+READS = {'idn', 'measureCurrent', 'measureVoltage', 'queryCurrent', 'queryVoltage', 'isOutputOn', 'measureAll',
+         'queryBatch'}
+
+
+# Writes that end up in the data log, method: keyword of the value
+SETPOINTS = {'setCurrent': 'current', 'setVoltage': 'voltage'}
+# Steps by the delta set on the supply, the new setpoint is read back for the log: method: (query, keyword)
+DELTAS = {'incCurrentByDelta': ('queryCurrent', 'current'), 'decCurrentByDelta': ('queryCurrent', 'current'),
+          'incVoltageByDelta': ('queryVoltage', 'voltage'), 'decVoltageByDelta': ('queryVoltage', 'voltage')}
+
+
+class BrokerStopped(RuntimeError):
+    pass
+
+
+class _Request:
+    def __init__(self, method, args, kwargs, key):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.key = key
+        self.future = Future()
+        self.taken = False
+        self.submitted = time.perf_counter()
+
+
+class DeviceBroker:
+    """Funnels all calls on one supply through a single worker thread.
+
+    Requests are served by priority (ramp setpoints before user control before
+    monitoring) and in submission order within a priority. A read that is
+    already waiting in the queue is not queued twice; later callers share its
+    result, and a higher priority caller moves it forward.
+    """
+
+    def __init__(self, supply):
+        self.supply = supply
+        self.queue = queue.PriorityQueue()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.order = itertools.count()
+        self.running = False
+        # datalog.DataLog that gets every setpoint write, optional
+        self.log = None
+        # added to the channel numbers in the log, the channel id offset of a fleet member
+        self.base = 0
+        self.thread = threading.Thread(target=self.run, name='DeviceBroker', daemon=True)
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+
+    def stop(self):
+        # requests still queued are cancelled, the one in progress finishes
+        with self.lock:
+            if not self.running:
+                return
+            self.running = False
+            self.queue.put((-1, next(self.order), None))
+        if threading.current_thread() is not self.thread:
+            self.thread.join()
+
+    def submit(self, method, *args, priority=PRIORITY_CONTROL, **kwargs):
+        key = None
+        if method in READS:
+            key = (method, args, tuple(sorted(kwargs.items())))
+        with self.lock:
+            if not self.running:
+                raise BrokerStopped('device broker is not running')
+            request = self.pending.get(key) if key is not None else None
+            if request is None:
+                request = _Request(method, args, kwargs, key)
+                if key is not None:
+                    self.pending[key] = request
+            # (re)queueing an already pending read just gives it another, possibly earlier, slot
+            self.queue.put((priority, next(self.order), request))
+        return request.future
+
+    def call(self, method, *args, priority=PRIORITY_CONTROL, **kwargs):
+        if threading.current_thread() is self.thread:
+            # called from inside a request, the queue is ours already
+            return getattr(self.supply, method)(*args, **kwargs)
+        return self.submit(method, *args, priority=priority, **kwargs).result()
+
+    def proxy(self, priority=PRIORITY_CONTROL):
+        return SupplyProxy(self, priority)
+
+    def run(self):
+        while True:
+            priority, _, request = self.queue.get()
+            if request is None:
+                break
+            with self.lock:
+                if request.taken:
+                    continue
+                request.taken = True
+                if request.key is not None:
+                    self.pending.pop(request.key, None)
+            if not request.future.set_running_or_notify_cancel():
+                continue
+            start = time.perf_counter()
+            try:
+                result = getattr(self.supply, request.method)(*request.args, **request.kwargs)
+            except Exception as e:
+                METRICS.count('supply.errors')
+                request.future.set_exception(e)
+            else:
+                if METRICS.enabled:
+                    METRICS.record('broker.wait', start - request.submitted)
+                    METRICS.record('supply.' + request.method, time.perf_counter() - start)
+                if self.log is not None and (request.method in SETPOINTS or request.method in DELTAS
+                                             or request.method == 'setCurrents'):
+                    self.logsetpoint(request)
+                request.future.set_result(result)
+        self.cancelpending()
+
+    def logsetpoint(self, request):
+        if request.method == 'setCurrents':
+            t = time.time()
+            for channel, current in request.args[0].items():
+                self.log.setpoint(t, self.base + channel, current=current)
+            return
+        if request.method in DELTAS:
+            query, keyword = DELTAS[request.method]
+            channel = request.args[0] if request.args else request.kwargs.get('channel')
+            try:
+                # one more round trip, only made while logging
+                value = getattr(self.supply, query)(channel=channel)
+            except Exception as e:
+                log.warning('Setpoint after %s not logged: %s', request.method, e)
+                return
+            if channel is None:
+                channel = self.supply.channel
+            self.log.setpoint(time.time(), self.base + channel, **{keyword: value})
+            return
+        keyword = SETPOINTS[request.method]
+        value = request.args[0] if request.args else request.kwargs[keyword]
+        channel = request.args[1] if len(request.args) > 1 else request.kwargs.get('channel')
+        if channel is None:
+            # written to the driver's current channel
+            channel = self.supply.channel
+        self.log.setpoint(time.time(), self.base + channel, **{keyword: value})
+
+    def cancelpending(self):
+        with self.lock:
+            self.pending.clear()
+            while True:
+                try:
+                    _, _, request = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request is not None and not request.taken:
+                    request.taken = True
+                    if request.future.set_running_or_notify_cancel():
+                        request.future.set_exception(BrokerStopped('device broker stopped'))
+
+
+class SupplyProxy:
+    """Looks like an AimTTiPLP, but every method call goes through the broker."""
+
+    def __init__(self, broker, priority):
+        self._broker = broker
+        self._priority = priority
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            return self._broker.call(name, *args, priority=self._priority, **kwargs)
+        call.__name__ = name
+        return call
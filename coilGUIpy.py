@@ -80,6 +80,12 @@ class Ui_MainWindow(object):
         self.label_deviceName.setSizePolicy(sizePolicy)
         self.label_deviceName.setObjectName("label_deviceName")
         self.gridLayout_2.addWidget(self.label_deviceName, 1, 1, 1, 2)
+        self.label_supply = QtWidgets.QLabel(self.groupBox)
+        self.label_supply.setObjectName("label_supply")
+        self.gridLayout_2.addWidget(self.label_supply, 2, 0, 1, 1)
+        self.comboBox_supply = QtWidgets.QComboBox(self.groupBox)
+        self.comboBox_supply.setObjectName("comboBox_supply")
+        self.gridLayout_2.addWidget(self.comboBox_supply, 2, 1, 1, 2)
         self.verticalLayout_3.addWidget(self.groupBox)
         self.groupBox_lcd = QtWidgets.QGroupBox(self.widget_2)
         sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Fixed)
@@ -384,6 +390,23 @@ class Ui_MainWindow(object):
         self.gridLayout_4.addWidget(self.doubleSpinBox_linrate, 1, 0, 1, 1)
         self.tabWidget_autocontrol.addTab(self.tab_3, "")
         self.verticalLayout_4.addWidget(self.tabWidget_autocontrol)
+        self.widget_rampcontrol = QtWidgets.QWidget(self.groupBox_automaticcurrentramp)
+        self.widget_rampcontrol.setObjectName("widget_rampcontrol")
+        self.horizontalLayout_rampcontrol = QtWidgets.QHBoxLayout(self.widget_rampcontrol)
+        self.horizontalLayout_rampcontrol.setObjectName("horizontalLayout_rampcontrol")
+        self.pushButton_ramppause = QtWidgets.QPushButton(self.widget_rampcontrol)
+        self.pushButton_ramppause.setEnabled(False)
+        self.pushButton_ramppause.setCheckable(True)
+        self.pushButton_ramppause.setObjectName("pushButton_ramppause")
+        self.horizontalLayout_rampcontrol.addWidget(self.pushButton_ramppause)
+        self.pushButton_rampabort = QtWidgets.QPushButton(self.widget_rampcontrol)
+        self.pushButton_rampabort.setEnabled(False)
+        self.pushButton_rampabort.setObjectName("pushButton_rampabort")
+        self.horizontalLayout_rampcontrol.addWidget(self.pushButton_rampabort)
+        self.label_rampstatus = QtWidgets.QLabel(self.widget_rampcontrol)
+        self.label_rampstatus.setObjectName("label_rampstatus")
+        self.horizontalLayout_rampcontrol.addWidget(self.label_rampstatus)
+        self.verticalLayout_4.addWidget(self.widget_rampcontrol)
         self.verticalLayout_3.addWidget(self.groupBox_automaticcurrentramp)
         self.horizontalLayout.addWidget(self.widget_2, 0, QtCore.Qt.AlignTop)
         self.widget_3 = QtWidgets.QWidget(self.widget)
@@ -402,10 +425,6 @@ class Ui_MainWindow(object):
         self.plot_2 = PlotWidget(self.widget_3)
         self.plot_2.setObjectName("plot_2")
         self.verticalLayout_2.addWidget(self.plot_2)
-        self.plot_3 = PlotWidget(self.widget_3)
-        self.plot_3.setEnabled(True)
-        self.plot_3.setObjectName("plot_3")
-        self.verticalLayout_2.addWidget(self.plot_3)
         self.horizontalLayout.addWidget(self.widget_3)
         self.verticalLayout.addWidget(self.widget)
         MainWindow.setCentralWidget(self.centralwidget)
@@ -429,6 +448,7 @@ class Ui_MainWindow(object):
         self.checkBox_connect.setText(_translate("MainWindow", "Connect"))
         self.lineEdit_resource.setText(_translate("MainWindow", "TCPIP0::169.254.70.222::9221::SOCKET"))
         self.label_deviceName.setText(_translate("MainWindow", "<connected to>"))
+        self.label_supply.setText(_translate("MainWindow", "Supply"))
         self.groupBox_lcd.setTitle(_translate("MainWindow", "Device Status - Measured Values!"))
         self.label_2.setText(_translate("MainWindow", "Voltage"))
         self.label_6.setText(_translate("MainWindow", "Voltage"))
@@ -474,6 +494,9 @@ class Ui_MainWindow(object):
         self.pushButton_linrampstart.setText(_translate("MainWindow", "Start Ramp"))
         self.pushButton_linrampshowtrajectory.setText(_translate("MainWindow", "Preview Trajectory"))
         self.tabWidget_autocontrol.setTabText(self.tabWidget_autocontrol.indexOf(self.tab_3), _translate("MainWindow", "Lin"))
+        self.pushButton_ramppause.setText(_translate("MainWindow", "Pause"))
+        self.pushButton_rampabort.setText(_translate("MainWindow", "Abort"))
+        self.label_rampstatus.setText(_translate("MainWindow", "No ramp running"))
 from pyqtgraph import PlotWidget
 
 
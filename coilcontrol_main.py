@@ -22,17 +22,33 @@
 #  Control a Aim TTi PL-P Series DC Power Supplies - Perform Current Ramps
 # -------------------------------------------------------------------------------
 
+import startup
 import sys
+import math
 from os import environ
 import time
 import threading
 import numpy as np
 import pyqtgraph as pg
-from PyQt5 import QtWidgets, QtCore
+from PyQt5 import QtWidgets, QtCore, QtGui
 from PyQt5.QtCore import pyqtSignal
-from dcps import AimTTiPLP
 from coilGUIpy import Ui_MainWindow
 from commserver import Server
+from commands import CommandRegistry, CommandError, SPEC, BADARGS, FAILED
+from telemetry import Subscription, SPACING, addresstext
+from acquisition import Acquisition
+from datalog import DataLog, LOGDIR
+from broker import PRIORITY_CONTROL, PRIORITY_RAMP
+from samplebuffer import SampleBuffer
+from remote import SampleStore
+from lod import MinMaxPyramid
+from ramp import RampExecutor, CoordinatedRamp
+import trajectory
+from metrics import METRICS
+from logconfig import getlogger, setup as setuplogging
+
+log = getlogger('gui')
+ramplog = getlogger('ramp')
 
 
 # TODO: Progress bar for ramp?!
@@ -42,14 +58,17 @@ class Dummy:
 
 
 class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
+    rampfinished = pyqtSignal(object)
+
     def __init__(self, *args, obj=None, **kwargs):
         super(MainWindow, self).__init__(*args, **kwargs)
         self.setupUi(self)
 
-        # Create Server
+        # Create Server, it starts listening in finishstartup once the window is shown
         self.server = Server()
-        self.server.sessionOpened()
         self.server.signals.msg.connect(self.serverevents)
+        self.commands = CommandRegistry()
+        self.commands.bind({name: getattr(self, 'remote_' + name) for name, _, _ in SPEC})
 
         # State Vars
         self.outputvar = False
@@ -60,46 +79,70 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         self.outputstats = [False, False, False]
         self.lcd = False
 
-        # Plot update timer
-        self.timer = QtCore.QTimer()
-        self.timer.setInterval(10)
-        self.timer.timeout.connect(self.update_plot_data)
-
-        self.hour = list(range(1000))
-        self.temperature = [0 for _ in range(1000)]
-        self.temperature2 = [0 for _ in range(1000)]
+        # Acquisition runs in its own thread once connected
+        self.acquisition = None
+        self.acquisitionInterval = 10  # ms
+        # broker proxies of the fleet while connected
+        self.supply = None
+        self.rampsupply = None
+        # samples and setpoints are logged here while connected, '' switches the log off
+        self.logDirectory = environ.get('coillog', LOGDIR)
+        self.datalog = None
+
+        # Sample history, times in s since connecting. One hour at 10 ms for the three channels
+        # of one supply, a fleet shares the same memory. The plots only draw what the min/max
+        # pyramids (voltage, current) select for the view. Set up in setupchannels
+        self.historyLength = 360000
+        self.samples = SampleStore(maxage=0.5)
+        self.lod = {}
+        # channel ids of the supply shown on the LCDs and used for manual control
+        self.supplybase = 0
+
+        # Display refresh, independent of the acquisition. Samples only mark the plots dirty,
+        # every frame draws all of them at once. A frame that took longer than frameBudget
+        # of the display interval makes the following frames be skipped.
+        self.displayInterval = 50  # ms
+        self.frameBudget = 0.5
+        self.plotdirty = False
+        self.skipframes = 0
+        self.droppedframes = 0
+        self.displaytimer = QtCore.QTimer()
+        self.displaytimer.setInterval(self.displayInterval)
+        self.displaytimer.timeout.connect(self.renderframe)
+        self.displaytimer.start()
+        # Timings of supply calls, frames, ramps and remote commands: a summary in the status bar,
+        # all of them in the Performance panel of the View menu
+        self.setupmetrics()
+        # one line per channel in the voltage and current plots
+        self.plotcolors = {1: (0, 0.4470 * 255, 0.7410 * 255),
+                           2: (0.8500 * 255, 0.3250 * 255, 0.0980 * 255),
+                           3: (0.4660 * 255, 0.6740 * 255, 0.1880 * 255)}
+        self.plotstyles = (QtCore.Qt.SolidLine, QtCore.Qt.DashLine, QtCore.Qt.DotLine, QtCore.Qt.DashDotLine)
+        self.voltlines = {}
+        self.currlines = {}
 
         # PLOT Window 1
         self.plot_1.setBackground('w')
-        pen = pg.mkPen(color=(0, 0.4470 * 255, 0.7410 * 255), width=3, syle=pg.QtCore.Qt.DashLine)
         self.plot_1.setTitle("<span style=\"color:black;font-size:15px\">Voltage</span>")
         self.plot_1.setLabel('left', 'Voltage (V)', color='grey')
-        self.plot_1.setLabel('bottom', 'Time (a.u.)', color='grey')
+        self.plot_1.setLabel('bottom', 'Time (s)', color='grey')
         self.plot_1.addLegend()
         self.plot_1.showGrid(x=True, y=True)
-        self.my_line_ref = self.plot(self.hour, self.temperature, name='Channel', pen=pen)
+        self.plot_1.getViewBox().sigXRangeChanged.connect(lambda: self.rangechanged(self.plot_1, self.voltlines, 0))
 
         # PlOT in Window 2
         self.plot_2.setBackground('w')
-        pen = pg.mkPen(color=(0.8500 * 255, 0.3250 * 255, 0.0980 * 255), width=3, syle=pg.QtCore.Qt.DashLine)
         self.plot_2.setTitle("<span style=\"color:black;font-size:15px\">Current</span>")
         self.plot_2.setLabel('left', 'Current (A)', color='grey')
-        self.plot_2.setLabel('bottom', 'Time (a.u.)', color='grey')
+        self.plot_2.setLabel('bottom', 'Time (s)', color='grey')
         self.plot_2.addLegend()
         self.plot_2.showGrid(x=True, y=True)
-        self.my_line_ref2 = self.plot_2.plot(self.hour, self.temperature2, name='Channel', pen=pen)
+        self.plot_2.getViewBox().sigXRangeChanged.connect(lambda: self.rangechanged(self.plot_2, self.currlines, 1))
         self.plot_2.setYRange(0, 3)
+        self.setupchannels((1, 2, 3))
 
-        # Plot in Window 3 - Trajectory
-        self.plot_3.setBackground('w')
-        pen = pg.mkPen(color=(0.8500 * 255, 0.3250 * 255, 0.0980 * 255), width=3, syle=pg.QtCore.Qt.DashLine)
-        self.plot_3.setTitle("<span style=\"color:black;font-size:15px\">Current Trajectory</span>")
-        self.plot_3.setLabel('left', 'Current (A)', color='grey')
-        self.plot_3.setLabel('bottom', 'Time (s)', color='grey')
-        self.plot_3.addLegend()
-        self.plot_3.showGrid(x=True, y=True)
-        # self.my_line_ref3 = self.plot_3.plot(self.hour, self.temperature2, name='Channel', pen=pen)
-        # self.plot_3.setYRange(0, 5)
+        # Plot in Window 3 - Trajectory, created by trajectoryplot when the first trajectory is shown
+        self.plot_3 = None
 
         # Connect to PS
         self.connected = False
@@ -113,6 +156,7 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         self.pushButton_setval.clicked.connect(lambda: self.clickevents(self.pushButton_setval))
         self.checkBox_automaticcontrol.stateChanged.connect(lambda: self.clickevents(self.checkBox_automaticcontrol))
         self.comboBox_channel.activated[str].connect(lambda: self.clickevents(self.comboBox_channel))
+        self.comboBox_supply.activated.connect(self.selectsupply)
 
         # Channel increment set
         self.pushButton_setincr.clicked.connect(lambda: self.clickevents(self.pushButton_setincr))
@@ -123,6 +167,12 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         self.pushButton_startramp.clicked.connect(lambda: self.clickevents(self.pushButton_startramp))
         self.smoothDwell = 100
         self.ramppoints = []
+        self.ramp = None
+        self.rampstatus = ''
+        self.rampTolerance = 0.  # A, 0 only merges identical setpoints
+        self.rampfinished.connect(self.rampdone)
+        self.pushButton_ramppause.toggled.connect(self.pauseramp)
+        self.pushButton_rampabort.clicked.connect(self.abortramp)
         self.pushButton_showtrajectorie.clicked.connect(lambda: self.clickevents(self.pushButton_showtrajectorie))
         self.pushButton_smoothrampstart.clicked.connect(lambda: self.clickevents(self.pushButton_smoothrampstart))
         self.pushButton_linrampshowtrajectory.clicked.connect(lambda:
@@ -131,33 +181,33 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
 
     def clickevents(self, b):
         if b.objectName() == 'pushButton_setval':
-            print('Set button clicked!')
+            log.debug('Set button clicked')
             if self.radio_cc1.isChecked() == True:
-                print('Current is set!')
+                log.debug('Current is set')
                 self.supply.setCurrent(self.doubleSpinBox_setval.value(), channel=self.channel)
             if self.radio_cv1.isChecked() == True:
-                print('Voltage is set!')
+                log.debug('Voltage is set')
                 self.supply.setVoltage(self.doubleSpinBox_setval.value(), channel=self.channel)
         if b.objectName() == 'pushButton_setincr':
             if self.radio_currinc.isChecked() == True:
-                print('Setting new current increment')
+                log.debug('Setting new current increment')
                 self.supply.setCurrentDelta(self.doubleSpinBox_setincr.value(), channel=self.channel)
             if self.radio_voltinc.isChecked() == True:
-                print('Setting new voltage increment')
+                log.debug('Setting new voltage increment')
                 self.supply.setVoltageDelta(self.doubleSpinBox_setincr.value(), channel=self.channel)
         if b.objectName() == 'pushButton_addincr':
             if self.radio_currinc.isChecked() == True:
-                print('Adding current increment to output')
+                log.debug('Adding current increment to output')
                 self.supply.incCurrentByDelta(channel=self.channel)
             if self.radio_voltinc.isChecked() == True:
-                print('Adding voltage increment to output')
+                log.debug('Adding voltage increment to output')
                 self.supply.incVoltageByDelta(channel=self.channel)
         if b.objectName() == 'pushButton_subincr':
             if self.radio_currinc.isChecked() == True:
-                print('Subtracting current increment to output')
+                log.debug('Subtracting current increment from output')
                 self.supply.decCurrentByDelta(channel=self.channel)
             if self.radio_voltinc.isChecked() == True:
-                print('Subtracting voltage increment to output')
+                log.debug('Subtracting voltage increment from output')
                 self.supply.decVoltageByDelta(channel=self.channel)
         if b.objectName() == 'checkBox_automaticcontrol':
             if b.isChecked() == True:
@@ -168,381 +218,612 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
                 self.tabWidget_autocontrol.setEnabled(False)
                 self.groupBox_channelcontrol.setEnabled(True)
         if b.objectName() == 'pushButton_startramp':
-            print('Starting the ramp!')
+            ramplog.info('Starting the incremental ramp')
             if not self.rampinprogress:
-                self.rampinprogress = True
+                self.setrampinprogress(True)
                 t = threading.Thread(target=self.rampcurrent, args=(self.doubleSpinBox_autoincr.value(),
                                                                     self.doubleSpinBox_target.value(),
                                                                     self.spinBox_dwell.value() / 1000,
                                                                     self.autostatvar))
                 t.start()
             else:
-                print('You can not start a second ramp thread!')
+                ramplog.warning('You can not start a second ramp thread')
         if b.objectName() == 'pushButton_showtrajectorie':
-            result = self.calcTrajectorie()
-            self.ramppoints = result[1]
-            self.smoothDwell = result[0]
-            x = result[2]
-            self.plot_3.clear()
-            pen = pg.mkPen(color=(0.8500 * 255, 0.3250 * 255, 0.0980 * 255), width=3, syle=pg.QtCore.Qt.DashLine)
-            self.my_line_ref3 = self.plot_3.plot(x, self.ramppoints, name='Smooth Edge Ramp', pen=pen)
-            # print(self.ramppoints)
+            self.showtrajectory(self.calcTrajectorie(), 'Smooth Edge Ramp')
         if b.objectName() == 'pushButton_smoothrampstart':
-            print('Starting smooth ramp!')
-            result = self.calcTrajectorie()
-            self.ramppoints = result[1]
-            self.smoothDwell = result[0]
-            x = result[2]
-            self.plot_3.clear()
-            pen = pg.mkPen(color=(0.8500 * 255, 0.3250 * 255, 0.0980 * 255), width=3, syle=pg.QtCore.Qt.DashLine)
-            self.my_line_ref3 = self.plot_3.plot(x, self.ramppoints, name='Smooth Edge Ramp', pen=pen)
-            t = threading.Thread(target=self.rampcurrentlist)
-            t.start()
+            ramplog.debug('Smooth ramp button clicked')
+            # the running ramp keeps its points and plot
+            if not self.ramprunning():
+                self.showtrajectory(self.calcTrajectorie(), 'Smooth Edge Ramp')
+                self.rampcurrentlist()
         if b.objectName() == 'pushButton_linrampshowtrajectory':
-            result = self.calcLinTrajectorie()
-            self.ramppoints = result[1]
-            self.smoothDwell = result[0]
-            x = result[2]
-            self.plot_3.clear()
-            pen = pg.mkPen(color=(0.8500 * 255, 0.3250 * 255, 0.0980 * 255), width=3, syle=pg.QtCore.Qt.DashLine)
-            self.my_line_ref3 = self.plot_3.plot(x, self.ramppoints, name='Linear Ramp', pen=pen)
+            self.showtrajectory(self.calcLinTrajectorie(), 'Linear Ramp')
         if b.objectName() == 'pushButton_linrampstart':
-            result = self.calcLinTrajectorie()
-            self.ramppoints = result[1]
-            self.smoothDwell = result[0]
-            x = result[2]
-            self.plot_3.clear()
-            pen = pg.mkPen(color=(0.8500 * 255, 0.3250 * 255, 0.0980 * 255), width=3, syle=pg.QtCore.Qt.DashLine)
-            self.my_line_ref3 = self.plot_3.plot(x, self.ramppoints, name='Linear Ramp', pen=pen)
-            t = threading.Thread(target=self.rampcurrentlist)
-            t.start()
+            if not self.ramprunning():
+                self.showtrajectory(self.calcLinTrajectorie(), 'Linear Ramp')
+                self.rampcurrentlist()
         if b.objectName() == 'comboBox_channel':
             self.updatelcd()
             if b.currentIndex() == 0:
-                self.channel = 1
+                self.setchannel(1)
                 if self.outputstats[0]:
                     self.checkBox_output.setChecked(True)
                 else:
                     self.checkBox_output.setChecked(False)
             if b.currentIndex() == 1:
-                self.channel = 2
+                self.setchannel(2)
                 if self.outputstats[1]:
                     self.checkBox_output.setChecked(True)
                 else:
                     self.checkBox_output.setChecked(False)
             if b.currentIndex() == 2:
-                self.channel = 3
+                self.setchannel(3)
                 if self.outputstats[2]:
                     self.checkBox_output.setChecked(True)
                 else:
                     self.checkBox_output.setChecked(False)
 
-    def serverevents(self, s):
-        value_1 = []
-        value_2 = []
-        print('main window catch')
-        print(s)
-        # decode message by scheme
-        if s.find(':') != -1:
-            s, value_1 = s.split(':')
-            # data,value_1,value_2=data.split(',')
-            if value_1.find(',') != -1:
-                value_1, value_2 = value_1.split(',')
-
-        if s:
-            self.callrespond(s, value_1, value_2)
-
-    def callrespond(self, s, value_1, value_2):
-
-        if s == 'get_volt':
-            voltvals = [self.lcd1_volt.value(), self.lcd2_volt.value(), self.lcd3_volt.value()]
-            value_1 = int(value_1)
-            reply = str(voltvals[value_1 - 1])
-            self.server.sendeasy(reply)
-
-        elif s == 'get_curr':
-            currvals = [self.lcd1_curr.value(), self.lcd2_curr.value(), self.lcd3_curr.value()]
-            value_1 = int(value_1)
-            reply = str(currvals[value_1 - 1])
-            self.server.sendeasy(reply)
-
-        elif s == 'set_channel':
-            value_1 = int(value_1)
-            self.comboBox_channel.setCurrentIndex(value_1 - 1)
-            self.clickevents(self.comboBox_channel)
-            s = 'Done!'
-            self.server.sendeasy(s)
-
-        elif s == 'set_output':
-            value_1 = int(value_1)
-            value_2 = int(value_2)
-            if value_2 == 1:
-                self.supply.outputOn(channel=value_1)
-                self.server.sendeasy('Done! ON')
-                if self.channel == value_1:
-                    self.checkBox_output.setChecked(True)
-            elif value_2 == 0:
-                self.supply.outputOff(channel=value_1)
-                self.server.sendeasy('Done! OFF')
-                if self.channel == value_1:
-                    self.checkBox_output.setChecked(False)
-            else:
-                print('wrong command')
-
-        elif s == 'set_current':
-            value_1 = int(value_1)
-            value_2 = float(value_2)
-            self.supply.setCurrent(value_2,channel=value_1)
-            self.server.sendeasy('Done!')
-
-        elif s == 'set_smoothtarget':
-            value_1 = float(value_1)
-            self.doubleSpinBox_smoothtarget.setValue(value_1)
-            self.server.sendeasy('Done!')
-
-        elif s == 'set_smoothrate':
-            value_1 = float(value_1)
-            self.doubleSpinBox_smoothrate.setValue((value_1))
-            self.server.sendeasy('Done!')
-
-        elif s == 'set_smoothdwell':
-            value_1 = int(value_1)
-            print(value_1)
-            self.spinBox_smoothdwell.setValue(value_1)
-            self.server.sendeasy('Done!')
-
-        elif s == 'start_smoothramp':
-            print('Starting ramp (remote!)')
-            self.checkBox_automaticcontrol.setChecked(True)
-            self.clickevents(self.pushButton_smoothrampstart)
-            self.server.sendeasy('Done!')
-
-        else:
-            s = 'Wrong-Command!'
-            self.server.sendeasy(s)
+    def serverevents(self, client, s):
+        # the reply goes back to the client that sent s
+        self.server.sendeasy(self.commands.dispatch(s, client))
+
+    def remote_list_supplies(self):
+        if self.acquisition is None or self.acquisition.fleet is None:
+            return '[]'
+        return self.acquisition.fleet.listing()
+
+    def remote_get_metrics(self, reset):
+        reply = METRICS.json()
+        if reset:
+            METRICS.reset()
+        return reply
+
+    def remote_get_volt(self, channel):
+        return str(self.measured(channel)[1])
+
+    def remote_get_curr(self, channel):
+        return str(self.measured(channel)[2])
+
+    def requiresupply(self):
+        # for remote commands that talk to the supplies
+        if self.supply is None:
+            raise CommandError(FAILED, 'not connected')
+
+    def measured(self, channel):
+        # (time, voltage, current) from the acquisition, one device query if that is too old
+        sample = self.samples.cached(channel)
+        if sample is None:
+            self.requiresupply()
+            t = time.time()
+            sample = self.samples.measured(channel, t, self.supply.measureAll((channel,)))
+        return sample
+
+    def remote_set_channel(self, channel):
+        # checked before anything changes
+        self.samples.check(channel)
+        self.comboBox_supply.setCurrentIndex(channel // SPACING)
+        self.selectsupply(channel // SPACING)
+        self.comboBox_channel.setCurrentIndex(channel % SPACING - 1)
+        self.clickevents(self.comboBox_channel)
+        return 'Done!'
+
+    def remote_set_output(self, channel, state):
+        self.requiresupply()
+        self.samples.check(channel)
+        if state == 1:
+            self.supply.outputOn(channel=channel)
+            if self.channel == channel:
+                self.checkBox_output.setChecked(True)
+            return 'Done! ON'
+        self.supply.outputOff(channel=channel)
+        if self.channel == channel:
+            self.checkBox_output.setChecked(False)
+        return 'Done! OFF'
+
+    def remote_set_current(self, channel, current):
+        self.requiresupply()
+        self.samples.check(channel)
+        self.supply.setCurrent(current, channel=channel)
+        return 'Done!'
+
+    def remote_set_smoothtarget(self, current):
+        self.doubleSpinBox_smoothtarget.setValue(current)
+        return 'Done!'
+
+    def remote_set_smoothrate(self, rate):
+        self.doubleSpinBox_smoothrate.setValue(rate)
+        return 'Done!'
+
+    def remote_set_smoothdwell(self, dwell):
+        self.spinBox_smoothdwell.setValue(dwell)
+        return 'Done!'
+
+    def remote_start_smoothramp(self):
+        self.requiresupply()
+        if self.ramp is not None and self.ramp.running:
+            raise CommandError(FAILED, 'ramp already running')
+        ramplog.info('Starting smooth ramp (remote)')
+        self.checkBox_automaticcontrol.setChecked(True)
+        self.clickevents(self.pushButton_smoothrampstart)
+        return 'Done!'
+
+    def remote_start_coordinatedramp(self, channels, targets):
+        if len(channels) != len(targets):
+            raise CommandError(BADARGS, 'one target per channel')
+        self.requiresupply()
+        for channel in channels:
+            self.samples.check(channel)
+        if self.ramp is not None and self.ramp.running:
+            raise CommandError(FAILED, 'ramp already running')
+        ramplog.info('Starting coordinated ramp (remote)')
+        self.rampcoordinated(channels, targets)
+        return 'Done!'
+
+    def remote_pause_ramp(self):
+        self.pushButton_ramppause.setChecked(True)
+        return 'Done!'
+
+    def remote_resume_ramp(self):
+        self.pushButton_ramppause.setChecked(False)
+        return 'Done!'
+
+    def remote_abort_ramp(self):
+        self.abortramp()
+        return 'Done!'
+
+    def remote_subscribe(self, client, channels, rate):
+        # samples come from the acquisition, a subscription adds no device traffic
+        self.server.subscribe(client, Subscription(channels, rate))
+        return 'Done!'
+
+    def remote_unsubscribe(self, client):
+        self.server.subscribe(client, None)
+        return 'Done!'
+
+    def remote_set_acquisitioninterval(self, interval):
+        self.setAcquisitionInterval(interval)
+        return 'Done!'
+
+    def remote_set_displayinterval(self, interval):
+        self.setDisplayInterval(interval)
+        return 'Done!'
+
+    def remote_get_samples(self, channel, count):
+        return self.samples.samples(channel, count)
+
+    def remote_get_history(self, channel, t0, t1, buckets, mode):
+        return self.samples.history(channel, t0, t1, buckets, mode)
+
+    def remote_binary(self, client, enabled):
+        # the reply is already sent in the new mode
+        self.server.setbinary(client, enabled)
+        return 'Done!'
 
     def chkstate(self, b):
         if b.objectName() == 'checkBox_output':
             if b.isChecked() == True:
-                print('Setting output ON')
+                log.debug('Setting output ON')
                 self.supply.outputOn(channel=self.channel)
             if b.isChecked() == False:
                 self.supply.outputOff(channel=self.channel)
-                print('Setting output OFF')
+                log.debug('Setting output OFF')
 
     def device_connect(self, state):
         if state == QtCore.Qt.Checked:
             # TODO: catch timeout and retry connecting
+            # the rest of the setup happens in device_started once the worker has opened the supply
             self.connectPs()
-            self.connected = True
-            self.label_deviceName.setText(self.supply.idn())
-            self.checkBox_output.setEnabled(True)
-            self.groupBox_channelcontrol.setEnabled(True)
-            self.timer.start()
-            self.groupBox_automaticcurrentramp.setEnabled(True)
-            self.updatelcd()
-            # dirty hack if channel 1 is already on
-            if self.outputstats[0]:
-                self.checkBox_output.setChecked(True)
         else:
             self.lcd = False
             self.checkBox_output.setChecked(False)
-            self.disconnectPs()
+            if self.acquisition is not None:
+                self.disconnectPs()
             self.connected = False
             self.checkBox_output.setEnabled(False)
-            self.timer.stop()
             self.groupBox_automaticcurrentramp.setEnabled(False)
             self.groupBox_channelcontrol.setEnabled(False)
 
+    def device_started(self, idn):
+        # all supply access goes through the brokers of the fleet, ramps jump the queue
+        fleet = self.acquisition.fleet
+        self.supply = fleet.proxy(PRIORITY_CONTROL)
+        self.rampsupply = fleet.proxy(PRIORITY_RAMP)
+        self.setupchannels(fleet.channels)
+        self.comboBox_supply.clear()
+        for member in fleet.members:
+            self.comboBox_supply.addItem('{}: {}'.format(member.index + 1, member.idn))
+        self.supplybase = 0
+        self.connected = True
+        self.label_deviceName.setText(idn)
+        self.checkBox_output.setEnabled(True)
+        self.groupBox_channelcontrol.setEnabled(True)
+        self.groupBox_automaticcurrentramp.setEnabled(True)
+        self.updatelcd()
+        # dirty hack if channel 1 is already on
+        if self.outputstats[0]:
+            self.checkBox_output.setChecked(True)
+
+    def device_failed(self, msg):
+        log.error('Acquisition error: %s', msg)
+        if not self.connected:
+            # could not open the supply at all
+            self.acquisition.stop()
+            self.acquisition = None
+            self.stopdatalog()
+            self.checkBox_connect.setChecked(False)
+
+    def device_recovered(self, failures):
+        log.info('Acquisition recovered after %d failed polls', failures)
+
+    def setchannel(self, channel):
+        # channel 1..3 of the selected supply
+        self.channel = self.supplybase + channel
+
+    def selectsupply(self, index):
+        self.supplybase = SPACING * index
+        self.setchannel(self.comboBox_channel.currentIndex() + 1)
+        if self.connected:
+            self.updatelcd()
+            self.checkBox_output.setChecked(self.outputstats[self.comboBox_channel.currentIndex()])
+
+    def setupchannels(self, channels):
+        # history, pyramids and plot lines for the channel ids of the fleet
+        capacity = max(self.historyLength * 3 // len(channels), 1000)
+        self.samples.reset(SampleBuffer(capacity, channels, time.time()))
+        self.lod = {ch: (MinMaxPyramid(buf.time, buf.voltage), MinMaxPyramid(buf.time, buf.current))
+                    for ch, buf in self.samples.buffer.channels.items()}
+        for plot, lines in ((self.plot_1, self.voltlines), (self.plot_2, self.currlines)):
+            for line in lines.values():
+                plot.removeItem(line)
+            lines.clear()
+            for ch in channels:
+                pen = pg.mkPen(color=self.plotcolors[ch % SPACING], width=3,
+                               style=self.plotstyles[ch // SPACING % len(self.plotstyles)])
+                lines[ch] = plot.plot([], [], name='CH{}'.format(addresstext(ch)), pen=pen)
+
+    def setrampinprogress(self, state):
+        # the incremental ramp queries the supply itself, so monitoring pauses meanwhile
+        self.rampinprogress = state
+        if self.acquisition is not None:
+            self.acquisition.worker.setPaused(state)
+
     def rampcurrent(self, delta, target, waittime, statvar):
-        self.rampinprogress = True
-        current = self.supply.queryCurrent(channel=self.channel)
+        self.setrampinprogress(True)
+        current = self.rampsupply.queryCurrent(channel=self.channel)
         # self.timer.stop()
         if statvar is False:
-            print('Deciding direction of ramp...')
+            ramplog.debug('Deciding direction of ramp')
             statvar = True
-            self.supply.setCurrentDelta(delta, channel=self.channel)
+            self.rampsupply.setCurrentDelta(delta, channel=self.channel)
             rampdirection = current - target
             if rampdirection > 0:
-                print('Ramping down!')
+                ramplog.info('Ramping down')
             elif rampdirection < 0:
-                print('Ramping up!')
+                ramplog.info('Ramping up')
             else:
-                print('Ramp direction is zero!')
+                ramplog.info('Ramp direction is zero')
 
         if rampdirection < 0:
             while current < target:
-                self.supply.incCurrentByDelta(channel=self.channel)
+                self.rampsupply.incCurrentByDelta(channel=self.channel)
                 time.sleep(waittime)
                 if current > target:
-                    print('Current larger than target, breaking!')
+                    ramplog.info('Current larger than target, stopping')
                     break
-                current = self.supply.queryCurrent(channel=self.channel)
+                current = self.rampsupply.queryCurrent(channel=self.channel)
                 # print(current)
         if rampdirection > 0:
             while current > target:
-                self.supply.decCurrentByDelta(channel=self.channel)
+                self.rampsupply.decCurrentByDelta(channel=self.channel)
                 time.sleep(waittime)
                 if current < target:
-                    print('Current smaller than target, breaking!')
+                    ramplog.info('Current smaller than target, stopping')
                     break
-                current = self.supply.queryCurrent(channel=self.channel)
+                current = self.rampsupply.queryCurrent(channel=self.channel)
                 # print(current)
-        print('Reached target vlue!')
-        self.rampinprogress = False
+        ramplog.info('Reached target value')
+        self.setrampinprogress(False)
         return 1
 
+    def ramprunning(self):
+        if self.ramp is not None and self.ramp.running:
+            ramplog.warning('You can not start a second ramp thread')
+            return True
+        return False
+
     def rampcurrentlist(self):
-        print('Smooth current ramp starting!')
-        for i in self.ramppoints:
-            # print(i)
-            self.supply.setCurrent(i, channel=self.channel, wait=0)
-            time.sleep(self.smoothDwell)
-            # print(i)
-        print('Finished ramp!')
-
-    def update_plot_data(self):
-        self.hour = self.hour[1:]
-        self.hour.append(self.hour[-1] + 1)
-
-        self.temperature = self.temperature[1:]
-        self.temperature2 = self.temperature2[1:]
-        if self.connected and not self.rampinprogress:
-            a = self.supply.measureCurrent(channel=self.channel)
-            b = self.supply.measureVoltage(channel=self.channel)
-            self.temperature.append(b)
-            self.temperature2.append(a)
-            if self.channel == 1:
+        if self.ramprunning():
+            return
+        ramplog.info('Smooth current ramp starting')
+        points, holds = trajectory.compress(self.ramppoints, self.smoothDwell, self.rampTolerance)
+        ramplog.info('%d setpoints, %d writes', len(self.ramppoints), len(points))
+        self.startramp(RampExecutor(self.rampsupply, points, holds, channel=self.channel,
+                                    onfinished=self.rampfinished.emit),
+                       'Ramping CH{}'.format(addresstext(self.channel)))
+
+    def rampcoordinated(self, channels, targets):
+        # all channels on one schedule with the rate and dwell of the smooth ramp tab
+        if self.ramprunning():
+            return
+        values = self.supply.measureAll(channels)
+        dwell, points, x = trajectory.coordinated([values[ch][1] for ch in channels], targets,
+                                                  self.doubleSpinBox_smoothrate.value() / 60.,
+                                                  self.spinBox_smoothdwell.value() / 1000., 'smooth')
+        plot = self.trajectoryplot()
+        plot.clear()
+        for i, ch in enumerate(channels):
+            pen = pg.mkPen(color=self.plotcolors[ch % SPACING], width=3)
+            plot.plot(x, points[:, i], name='CH{}'.format(addresstext(ch)), pen=pen)
+        points, holds = trajectory.compress(points, dwell, self.rampTolerance)
+        ramplog.info('%d setpoints, %d writes', len(x), len(points))
+        self.startramp(CoordinatedRamp(self.rampsupply, points, holds, channels, onfinished=self.rampfinished.emit),
+                       'Ramping CH{}'.format(' + CH'.join(addresstext(ch) for ch in channels)))
+
+    def startramp(self, ramp, status):
+        self.ramp = ramp
+        self.pushButton_ramppause.setChecked(False)
+        self.pushButton_ramppause.setEnabled(True)
+        self.pushButton_rampabort.setEnabled(True)
+        # shown again when a pause ends
+        self.rampstatus = status
+        self.label_rampstatus.setText(status)
+        self.ramp.start()
+
+    def rampdone(self, ramp):
+        # runs in the GUI thread, emitted by the ramp thread when it ends
+        report = ramp.report()
+        ramplog.info('Finished ramp: %s', report)
+        self.pushButton_ramppause.setEnabled(False)
+        self.pushButton_rampabort.setEnabled(False)
+        if report['error'] is not None:
+            status = 'Failed: {} after {} of {} points'.format(report['error'], report['written'], report['points'])
+        elif report['aborted']:
+            status = 'Aborted after {} of {} points'.format(report['written'], report['points'])
+        else:
+            status = 'Done in {:.1f} s (planned {:.1f} s)'.format(report['achieved_duration'],
+                                                                 report['planned_duration'])
+        if 'jitter_p99' in report:
+            status += ', jitter p99 {:.1f} ms'.format(report['jitter_p99'] * 1000)
+        if 'skew_max' in report:
+            status += ', skew max {:.1f} ms'.format(report['skew_max'] * 1000)
+        self.label_rampstatus.setText(status)
+
+    def pauseramp(self, state):
+        if self.ramp is None:
+            return
+        if state:
+            self.ramp.pause()
+            self.label_rampstatus.setText('Paused at point {} of {}'.format(self.ramp.index, len(self.ramp.points)))
+        else:
+            self.ramp.resume()
+            self.label_rampstatus.setText(self.rampstatus)
+
+    def abortramp(self):
+        if self.ramp is not None:
+            self.ramp.abort()
+
+    def update_plot_data(self, t, values):
+        # slot for AcquisitionWorker.sample: timestamp, {channel: (voltage, current)}
+        self.samples.append(t, values)
+        self.server.publish(t, values)
+        epoch = self.samples.buffer.epoch
+        for channel, (b, a, *_) in values.items():
+            ts = t - epoch
+            self.lod[channel][0].append(ts, b)
+            self.lod[channel][1].append(ts, a)
+        self.plotdirty = True
+
+    def renderframe(self):
+        if self.skipframes:
+            self.skipframes -= 1
+            self.droppedframes += 1
+            METRICS.count('plot.dropped')
+            return
+        if not self.plotdirty:
+            return
+        self.plotdirty = False
+        start = time.perf_counter()
+        for channel, (_, b, a) in self.samples.latest.values.items():
+            channel -= self.supplybase
+            if channel == 1:
                 self.lcd1_volt.display(b)
                 self.lcd1_curr.display(a)
-            if self.channel == 2:
+            if channel == 2:
                 self.lcd2_volt.display(b)
                 self.lcd2_curr.display(a)
-            if self.channel == 3:
+            if channel == 3:
                 self.lcd3_volt.display(b)
                 self.lcd3_curr.display(a)
+        self.updateplots()
+        # paint now instead of later in the event loop, so the time includes the painting
+        self.plot_1.repaint()
+        self.plot_2.repaint()
+        cost = time.perf_counter() - start
+        budget = self.displayInterval / 1000. * self.frameBudget
+        if METRICS.enabled:
+            METRICS.record('plot.frame', cost)
+        if cost > budget:
+            METRICS.overrun('plot.frame')
+            self.skipframes = math.ceil(cost / budget) - 1
+
+    def setupmetrics(self):
+        self.metricstext = QtWidgets.QPlainTextEdit()
+        self.metricstext.setReadOnly(True)
+        self.metricstext.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont))
+        record = QtWidgets.QCheckBox('Record')
+        record.setChecked(METRICS.enabled)
+        record.toggled.connect(lambda state: setattr(METRICS, 'enabled', state))
+        reset = QtWidgets.QPushButton('Reset')
+        reset.clicked.connect(METRICS.reset)
+        buttons = QtWidgets.QHBoxLayout()
+        buttons.addWidget(record)
+        buttons.addStretch()
+        buttons.addWidget(reset)
+        layout = QtWidgets.QVBoxLayout()
+        layout.addWidget(self.metricstext)
+        layout.addLayout(buttons)
+        panel = QtWidgets.QWidget()
+        panel.setLayout(layout)
+        self.metricsdock = QtWidgets.QDockWidget('Performance', self)
+        self.metricsdock.setObjectName('metricsdock')
+        self.metricsdock.setWidget(panel)
+        self.addDockWidget(QtCore.Qt.RightDockWidgetArea, self.metricsdock)
+        self.metricsdock.hide()
+        self.menubar.addMenu('&View').addAction(self.metricsdock.toggleViewAction())
+        self.metricstimer = QtCore.QTimer()
+        self.metricstimer.setInterval(1000)
+        self.metricstimer.timeout.connect(self.showmetrics)
+        self.metricstimer.start()
+
+    def showmetrics(self):
+        snapshot = METRICS.snapshot()
+        status = ['{} p99 {:.1f} ms'.format(name, snapshot['timers'][name]['p99'])
+                  for name in ('acquisition.poll', 'plot.frame') if name in snapshot['timers']]
+        overruns = sum(snapshot['overruns'].values())
+        if overruns:
+            status.append('{} overruns'.format(overruns))
+        self.statusbar.showMessage(', '.join(status))
+        if self.metricsdock.isVisible():
+            self.metricstext.setPlainText(METRICS.text())
+
+    def setDisplayInterval(self, interval):
+        self.displayInterval = int(interval)
+        self.displaytimer.setInterval(self.displayInterval)
+
+    def setAcquisitionInterval(self, interval):
+        self.acquisitionInterval = int(interval)
+        if self.acquisition is not None:
+            self.acquisition.worker.setInterval(self.acquisitionInterval)
+
+    def updateplots(self):
+        self.drawplot(self.plot_1, self.voltlines, 0)
+        self.drawplot(self.plot_2, self.currlines, 1)
+
+    def drawplot(self, plot, lines, column):
+        # at most about two points per pixel of the visible range, however long the history
+        viewbox = plot.getViewBox()
+        pixels = max(int(viewbox.width()), 100)
+        if viewbox.autoRangeEnabled()[0]:
+            x0, x1 = -np.inf, np.inf
         else:
-            self.temperature.append(0)
-            self.temperature2.append(0)
-
-        self.my_line_ref.setData(self.hour, self.temperature)
-        self.my_line_ref2.setData(self.hour, self.temperature2)
+            # half a view on either side, so panning shows data before the next update
+            x0, x1 = viewbox.viewRange()[0]
+            x0, x1 = x0 - (x1 - x0) / 2, x1 + (x1 - x0) / 2
+            pixels *= 2
+        for ch, line in lines.items():
+            line.setData(*self.lod[ch][column].select(x0, x1, pixels))
+
+    def rangechanged(self, plot, lines, column):
+        # zoom or pan by the user, autoscaling redraws with the next sample anyway
+        if not plot.getViewBox().autoRangeEnabled()[0]:
+            self.drawplot(plot, lines, column)
 
     def plot(self, hour, temperature, **kwargs):
         my_line_ref = self.plot_1.plot(hour, temperature, **kwargs)
         return my_line_ref
 
+    def finishstartup(self):
+        # runs from the event loop after the window has been painted
+        self.server.sessionOpened()
+        startup.phase('server')
+        log.info('Startup: %s', startup.report())
+
     def closeEvent(self, event):
-        if self.connected:
-            print('Device still connected, disconnecting!')
+        if self.acquisition is not None:
+            log.info('Device still connected, disconnecting')
             self.disconnectPs()
             self.connected = False
 
-        print('Ending software - byeeee')
+        log.info('Ending software - byeeee')
 
     def connectPs(self):
         self.address = self.lineEdit_resource.text()
-        print("Connecting to", self.address)
+        log.info('Connecting to %s', self.address)
         self.resource = environ.get('aimtti', self.address)
-        self.supply = AimTTiPLP(self.resource)
-        self.supply.open()
+        if self.logDirectory:
+            self.datalog = DataLog(self.logDirectory)
+            self.datalog.start()
+        self.acquisition = Acquisition(self.resource, self.acquisitionInterval, self.datalog)
+        self.acquisition.worker.started.connect(self.device_started)
+        self.acquisition.worker.failed.connect(self.device_failed)
+        self.acquisition.worker.recovered.connect(self.device_recovered)
+        self.acquisition.worker.sample.connect(self.update_plot_data)
+        self.acquisition.start()
 
     def disconnectPs(self):
-        # self.supply.outputOffAll()
-        self.supply.setLocal()
-        self.supply.close()
-        print("Disconnecting from", self.address)
+        if self.ramp is not None and self.ramp.running:
+            ramplog.warning('Aborting running ramp')
+            self.ramp.abort()
+            self.ramp.wait()
+        # the worker sets the supply back to local and closes it in its own thread
+        self.acquisition.stop()
+        self.acquisition = None
+        self.stopdatalog()
+        self.supply = None
+        self.rampsupply = None
+        # nothing from the closed connection is answered any more
+        self.samples.latest.clear()
+        log.info('Disconnecting from %s', self.address)
         self.label_deviceName.setText('<connected to>')
 
+    def stopdatalog(self):
+        # writes out what is still queued
+        if self.datalog is not None:
+            self.datalog.stop()
+            log.info('Data logged to %s', self.datalog.path)
+            self.datalog = None
+
     def modechoose(self, b):
         if b.text() == "Current" and b.isChecked():
             self.modevariable = False
-            print('Current branch', self.modevariable)
+            log.debug('Current mode selected')
 
         if b.text() == "Voltage" and b.isChecked():
             self.modevariable = True
-            print('voltage branch', self.modevariable)
+            log.debug('Voltage mode selected')
 
     def calcTrajectorie(self):
-        print('Calculating current trajectorie!')
-        if self.checkBox_connect.isChecked() == True:
-            currentnow = self.supply.measureCurrent(channel=self.channel)
-        else:
-            currentnow = 0.
-
-        target = self.doubleSpinBox_smoothtarget.value()
-        y3 = abs(currentnow - target)
-        rate = self.doubleSpinBox_smoothrate.value() / 60.
-        dwell = self.spinBox_smoothdwell.value() / 1000.
-
-        x3 = y3 / rate  # ramp time
-        reso = x3 / dwell
-        # print('Ramp contains {} points'.format(reso))
-
-        x = np.linspace(0, x3, int(reso))
-        y = np.piecewise(x, [x < x3 / 3, (x3 / 3 <= x) * (x < 2 * x3 / 3), (2 * x3 / 3 <= x) * (x <= x3)],
-                         [lambda x: (9 * np.square(x) * y3) / (4 * x3 ** 2),
-                          lambda x: -(y3 / 4) + (3 * x * y3) / (2 * x3),
-                          lambda x: -((5 * y3) / 4) - (9 * np.square(x) * y3) /
-                                    (4 * x3 ** 2) + (9 * x * y3) / (2 * x3)])
-        y = y.round(decimals=3)
-
-        if target < currentnow:
-            print('Ramp is down!')
-            yy = np.flip(y) + target
-        if target > currentnow:
-            print('Ramp is up!')
-            yy = y + currentnow
-        if np.round(target, decimals=3) == np.round(currentnow, decimals=3):
-            print('Already at target!')
-            yy = y
-
-        timeplot = np.linspace(0, dwell * len(x), len(x))
-        # plt.ion()
-        # plt.plot(timeplot, yy)
-        return dwell, yy, timeplot
+        return self.calctrajectory(self.doubleSpinBox_smoothtarget.value(), self.doubleSpinBox_smoothrate.value(),
+                                   self.spinBox_smoothdwell.value(), 'smooth')
 
     def calcLinTrajectorie(self):
-        print('Calculating current trajectory!')
+        return self.calctrajectory(self.doubleSpinBox_lintarget.value(), self.doubleSpinBox_linrate.value(),
+                                   self.spinBox_lindwell.value(), 'linear')
+
+    def calctrajectory(self, target, rate, dwell, shape):
+        # rate in A/min and dwell in ms as shown in the GUI
+        ramplog.debug('Calculating current trajectory')
         if self.checkBox_connect.isChecked() == True:
-            # print('Meausring current!')
             currentnow = self.supply.measureCurrent(channel=self.channel)
         else:
             currentnow = 0.
+        return trajectory.trajectory(currentnow, target, rate / 60., dwell / 1000., shape)
 
-        target = self.doubleSpinBox_lintarget.value()
-        y3 = abs(currentnow - target)
-        rate = self.doubleSpinBox_linrate.value() / 60.
-        dwell = self.spinBox_lindwell.value() / 1000.
-
-        x3 = y3 / rate  # ramp time
-        reso = x3 / dwell
-
-        x = np.linspace(0, x3, int(reso))
-        y = rate * x
-        y = y.round(decimals=3)
-
-        if target < currentnow:
-            # print('Ramp is down!')
-            yy = np.flip(y) + target
-        if target > currentnow:
-            # print('Ramp is up!')
-            yy = y + currentnow
-        if target == currentnow:
-            # print('Target current already set?')
-            yy = y
-
-        # plt.ion()
-        # plt.plot(x, yy)
-        timeplot = np.linspace(0, dwell * len(x), len(x))
-
-        return dwell, yy, timeplot
+    def showtrajectory(self, result, name):
+        self.smoothDwell, self.ramppoints, x = result
+        plot = self.trajectoryplot()
+        plot.clear()
+        pen = pg.mkPen(color=(0.8500 * 255, 0.3250 * 255, 0.0980 * 255), width=3, syle=pg.QtCore.Qt.DashLine)
+        self.my_line_ref3 = plot.plot(x, self.ramppoints, name=name, pen=pen)
+
+    def trajectoryplot(self):
+        if self.plot_3 is None:
+            self.plot_3 = pg.PlotWidget(self.widget_3)
+            self.plot_3.setObjectName('plot_3')
+            self.verticalLayout_2.addWidget(self.plot_3)
+            self.plot_3.setBackground('w')
+            self.plot_3.setTitle("<span style=\"color:black;font-size:15px\">Current Trajectory</span>")
+            self.plot_3.setLabel('left', 'Current (A)', color='grey')
+            self.plot_3.setLabel('bottom', 'Time (s)', color='grey')
+            self.plot_3.addLegend()
+            self.plot_3.showGrid(x=True, y=True)
+        return self.plot_3
 
     def updatelcd(self):
+        # V, I and output state of all channels in one round-trip
+        values = self.supply.measureAll(tuple(self.supplybase + ch for ch in (1, 2, 3)), outputs=True)
         for i in range(3):
-            curr = self.supply.measureCurrent(channel=(i + 1))
-            volt = self.supply.measureVoltage(channel=(i + 1))
-            self.outputstats[i] = self.supply.isOutputOn(channel=(i + 1))
+            volt, curr, self.outputstats[i] = values[self.supplybase + i + 1]
             if i == 0:
                 self.lcd1_curr.display(curr)
                 self.lcd1_volt.display(volt)
@@ -555,15 +836,21 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
                 self.label_chan2.setText(status)
             if i == 2:
                 self.lcd3_curr.display(curr)
-                self.lcd3_volt.display(curr)
+                self.lcd3_volt.display(volt)
                 status = "CH3 - {}".format(self.outputstats[2])
                 self.label_chan3.setText(status)
 
 
 def main():
+    startup.phase('imports')
+    setuplogging()
     app = QtWidgets.QApplication(sys.argv)
     main = MainWindow()
+    startup.phase('window')
     main.show()
+    app.processEvents()
+    startup.phase('shown')
+    QtCore.QTimer.singleShot(0, main.finishstartup)
     sys.exit(app.exec_())
 
 
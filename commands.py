@@ -0,0 +1,217 @@
+# -------------------------------------------------------------------------------
+#  Remote command set - grammar, argument validation and dispatch
+# -------------------------------------------------------------------------------
+
+import inspect
+import json
+import math
+import re
+import time
+from metrics import METRICS
+from logconfig import getlogger
+from telemetry import address, channellist, floatlist
+
+log = getlogger('commands')
+
+# name[:arg[,arg...]]
+GRAMMAR = re.compile(r'^([A-Za-z_][A-Za-z0-9_]*)(?::(.*))?$')
+
+# Replies for failed commands, everything after the tag is a human readable detail
+UNKNOWN = 'Wrong-Command!'
+BADARGS = 'Wrong-Arguments!'
+FAILED = 'Failed!'
+
+
+class CommandError(Exception):
+    def __init__(self, tag, detail=''):
+        super().__init__(detail)
+        self.tag = tag
+        self.detail = detail
+
+    def reply(self):
+        return '{} {}'.format(self.tag, self.detail).rstrip()
+
+
+class Arg:
+    def __init__(self, name, type, min=None, max=None, choices=None, default=None):
+        self.name = name
+        self.type = type
+        self.min = min
+        self.max = max
+        self.choices = choices
+        self.default = default
+
+    @property
+    def optional(self):
+        return self.default is not None
+
+    def convert(self, text):
+        try:
+            value = self.type(text.strip())
+        except ValueError:
+            raise CommandError(BADARGS, '{} must be {}, got "{}"'.format(self.name, self.type.__name__, text))
+        if self.choices is not None and value not in self.choices:
+            raise CommandError(BADARGS, '{} must be one of {}'.format(self.name, ', '.join(map(str, self.choices))))
+        # the limits hold for every value of a list
+        for v in value if isinstance(value, tuple) else (value,):
+            # nan passes every range check
+            if isinstance(v, float) and not math.isfinite(v):
+                raise CommandError(BADARGS, '{} must be a finite number, got "{}"'.format(self.name, text))
+            if (self.min is not None and v < self.min) or (self.max is not None and v > self.max):
+                raise CommandError(BADARGS, '{} must be within [{}, {}]'.format(self.name, self.min, self.max))
+        return value
+
+    def describe(self):
+        d = {'name': self.name, 'type': self.type.__name__}
+        for key in ('min', 'max', 'choices', 'default'):
+            if getattr(self, key) is not None:
+                d[key] = getattr(self, key)
+        return d
+
+
+# A, highest ramp target
+MAXTARGET = 5.
+
+# '<channel>' on the first supply or '<supply>:<channel>'
+CHANNEL = Arg('channel', address)
+
+# name, arguments, help - the command set shared by the GUI and the headless service
+SPEC = [
+    ('list_supplies', (), 'Supplies of the fleet with their channel addresses as JSON'),
+    ('get_volt', (CHANNEL,), 'Measured voltage of a channel (V)'),
+    ('get_curr', (CHANNEL,), 'Measured current of a channel (A)'),
+    ('set_channel', (CHANNEL,), 'Select the channel for manual control and ramps'),
+    ('set_output', (CHANNEL, Arg('state', int, choices=(0, 1))), 'Switch a channel output off (0) or on (1)'),
+    ('set_current', (CHANNEL, Arg('current', float, min=0.)), 'Set the current of a channel (A)'),
+    ('set_smoothtarget', (Arg('current', float, min=0., max=MAXTARGET),), 'Target current of the smooth ramp (A)'),
+    ('set_smoothrate', (Arg('rate', float, min=0.001, max=100.),), 'Rate of the smooth ramp (A/min)'),
+    ('set_smoothdwell', (Arg('dwell', int, min=1, max=1000),), 'Time per setpoint of the smooth ramp (ms)'),
+    ('start_smoothramp', (), 'Start the smooth ramp on the selected channel'),
+    ('start_coordinatedramp', (Arg('channels', channellist), Arg('targets', floatlist, min=0., max=MAXTARGET)),
+     'Ramp channels like 1+2:1 together to targets like 1.0+0.5 (A) at the smooth ramp rate and dwell'),
+    ('pause_ramp', (), 'Pause the running ramp'),
+    ('resume_ramp', (), 'Resume a paused ramp'),
+    ('abort_ramp', (), 'Abort the running ramp'),
+    ('subscribe', (Arg('channels', channellist, default=(1, 2, 3)),
+                   Arg('rate', float, min=0.01, max=1000., default=10.)),
+     'Push sample:<time>,<channel>,<voltage>,<current> lines for channels like 1+3 at up to rate (Hz)'),
+    ('unsubscribe', (), 'Stop the sample stream of this connection'),
+    ('set_acquisitioninterval', (Arg('interval', int, min=1, max=10000),), 'Time between two measurements (ms)'),
+    ('set_displayinterval', (Arg('interval', int, min=10, max=10000),), 'Time between two plot updates (ms), GUI only'),
+    ('get_samples', (CHANNEL, Arg('count', int, min=1, default=1000)),
+     'Newest buffered samples of a channel, one SAMPLES frame in binary mode'),
+    ('get_history', (CHANNEL, Arg('t0', float), Arg('t1', float), Arg('buckets', int, min=0, default=0),
+                     Arg('mode', str, choices=('min', 'max', 'mean'), default='mean')),
+     'Buffered samples of a channel between t0 and t1 (time.time(), <= 0 is seconds before now), '
+     'reduced to buckets values with min, max or mean when buckets > 0'),
+    ('get_metrics', (Arg('reset', int, choices=(0, 1), default=0),),
+     'Timers (ms), counters and overruns as JSON, since the start or the last reset (1 resets after the reply)'),
+    ('binary', (Arg('enabled', int, choices=(0, 1)),),
+     'Switch this connection to length-prefixed binary frames (1) or text lines (0), see protocol.py'),
+]
+
+# handlers of these get the id of the calling client as first argument
+CLIENTCOMMANDS = {'subscribe', 'unsubscribe', 'binary'}
+
+
+class Command:
+    def __init__(self, name, args, handler, help='', withclient=False):
+        self.name = name
+        self.args = tuple(args)
+        self.handler = handler
+        self.help = help
+        self.withclient = withclient
+        self.required = sum(1 for a in self.args if not a.optional)
+
+    def parse(self, argtext):
+        texts = argtext.split(',') if argtext else []
+        if not self.required <= len(texts) <= len(self.args):
+            raise CommandError(BADARGS, '{} takes {}'.format(
+                self.name, ', '.join(a.name for a in self.args) or 'no arguments'))
+        values = [a.convert(t) for a, t in zip(self.args, texts)]
+        values += [a.default for a in self.args[len(texts):]]
+        return values
+
+    def call(self, values, client):
+        if self.withclient:
+            return self.handler(client, *values)
+        return self.handler(*values)
+
+    def describe(self):
+        return {'name': self.name, 'args': [a.describe() for a in self.args], 'help': self.help}
+
+
+class CommandRegistry:
+    """Maps command names to handlers.
+
+    A line is matched once against GRAMMAR, the command is looked up in a
+    dict and its arguments are converted and checked before the handler is
+    called. Handlers return the reply string or a protocol.SampleBlock, every
+    failure becomes a reply starting with one of the tags above instead of an
+    exception.
+    """
+
+    def __init__(self):
+        self.commands = {}
+        self.register('list_commands', self.listing, help='All commands with their arguments as JSON')
+
+    def register(self, name, handler, args=(), help='', withclient=False):
+        self.commands[name] = Command(name, args, handler, help, withclient)
+
+    def bind(self, handlers):
+        # register handlers {name: callable} for the commands in SPEC
+        for name, args, help in SPEC:
+            if name in handlers:
+                self.register(name, handlers[name], args, help, name in CLIENTCOMMANDS)
+
+    def parse(self, line):
+        match = GRAMMAR.match(line.strip())
+        if match is None:
+            raise CommandError(UNKNOWN)
+        command = self.commands.get(match.group(1))
+        if command is None:
+            raise CommandError(UNKNOWN)
+        return command, command.parse(match.group(2))
+
+    def dispatch(self, line, client=None):
+        start = time.perf_counter()
+        name = 'invalid'
+        try:
+            command, values = self.parse(line)
+            name = command.name
+            return command.call(values, client)
+        except CommandError as e:
+            METRICS.count('command.errors')
+            return e.reply()
+        except Exception as e:
+            METRICS.count('command.errors')
+            log.exception('Command failed: %s', line)
+            return '{} {}'.format(FAILED, e)
+        finally:
+            if METRICS.enabled:
+                METRICS.record('command.' + name, time.perf_counter() - start)
+
+    async def dispatchasync(self, line, client=None):
+        # same as dispatch for handlers that may be coroutines
+        start = time.perf_counter()
+        name = 'invalid'
+        try:
+            command, values = self.parse(line)
+            name = command.name
+            reply = command.call(values, client)
+            if inspect.isawaitable(reply):
+                reply = await reply
+            return reply
+        except CommandError as e:
+            METRICS.count('command.errors')
+            return e.reply()
+        except Exception as e:
+            METRICS.count('command.errors')
+            log.exception('Command failed: %s', line)
+            return '{} {}'.format(FAILED, e)
+        finally:
+            if METRICS.enabled:
+                METRICS.record('command.' + name, time.perf_counter() - start)
+
+    def listing(self):
+        return json.dumps([c.describe() for c in self.commands.values()])
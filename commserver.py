@@ -1,40 +1,88 @@
 import sys
+import itertools
+import protocol
+from remote import drain
+from logconfig import getlogger
 # from PyQt5.QtCore import QByteArray, QDataStream, QIODevice
 from PyQt5.QtWidgets import QApplication, QDialog
 from PyQt5.QtNetwork import QHostAddress, QTcpServer
 from PyQt5.QtCore import pyqtSignal, pyqtSlot, QObject
 
+log = getlogger('server')
+
+
+class ClientConnection(protocol.LineBuffer):
+    # Socket plus the bytes received so far that do not form a complete line yet
+    def __init__(self, client, socket):
+        super().__init__()
+        self.client = client
+        self.socket = socket
+        self.subscription = None
+        # replies as protocol frames instead of text lines
+        self.binary = False
+
 
 class Server(QDialog):
+    # Clients stay connected and send newline terminated commands, several
+    # commands may be sent without waiting for the replies. Replies go back to
+    # the client that sent the command, in order. Reading is driven by
+    # readyRead only, a client that sends half a line never blocks anyone.
     def __init__(self):
         super().__init__()
         self.tcpServer = None
         self.signals = ServerSignals()
-        self.clientConnection = None
+        self.clients = {}
+        self.clientids = itertools.count(1)
+        # client whose command is being handled right now
+        self.current = None
 
     def sessionOpened(self):
         self.tcpServer = QTcpServer(self)
         PORT = 65432
         address = QHostAddress('127.0.0.1')
         if not self.tcpServer.listen(address, PORT):
-            print("cant listen!")
+            log.error('Can not listen on port %d: %s', PORT, self.tcpServer.errorString())
             self.close()
             return
         self.tcpServer.newConnection.connect(self.dealCommunication)
 
     @pyqtSlot()
     def dealCommunication(self):
-        # Get a QTcpSocket from the QTcpServer
-        self.clientConnection = self.tcpServer.nextPendingConnection()
+        while self.tcpServer.hasPendingConnections():
+            # Get a QTcpSocket from the QTcpServer
+            socket = self.tcpServer.nextPendingConnection()
+            client = next(self.clientids)
+            log.info('Client %d connected from %s', client, socket.peerAddress().toString())
+            self.clients[client] = ClientConnection(client, socket)
+            socket.readyRead.connect(lambda client=client: self.readClient(client))
+            socket.disconnected.connect(lambda client=client: self.dropClient(client))
+            socket.bytesWritten.connect(lambda _, client=client: self.flush(client))
 
-        # wait until the connection is ready to read
-        self.clientConnection.waitForReadyRead()
-        # read incomming data
-        instr = self.clientConnection.readAll()
+    def readClient(self, client):
+        connection = self.clients.get(client)
+        if connection is None:
+            return
+        for line in connection.feed(bytes(connection.socket.readAll())):
+            if line is None:
+                log.warning('Client %d sent an overlong line, discarding it', client)
+                self.sendeasy(protocol.TOOLONG, client)
+                continue
+            line = str(line, encoding='utf-8', errors='replace').strip()
+            if not line:
+                continue
+            log.debug('Client %d: %s', client, line)
+            # raise signal with message, the slot runs right away and may reply through sendeasy
+            self.current = client
+            try:
+                self.signals.msg.emit(client, line)
+            finally:
+                self.current = None
 
-        # raise signal with message
-        tomaingui = str(instr, encoding='utf-8')
-        self.signals.msg.emit(tomaingui)
+    def dropClient(self, client):
+        connection = self.clients.pop(client, None)
+        if connection is not None:
+            # an unterminated last line is dropped with the connection
+            connection.socket.deleteLater()
 
     # def sendtoclient(self, msg):
     #     # OLD Might be deleted in next version
@@ -60,15 +108,46 @@ class Server(QDialog):
     #     # now disconnect connection.
     #     self.clientConnection.disconnectFromHost()
 
-    def sendeasy(self, msg):
-        message = msg + '\n'
-        out = bytes(message, 'utf-8')
-        self.clientConnection.write(out)
-        self.clientConnection.disconnectFromHost()
+    def subscribe(self, client, subscription):
+        # subscription is a telemetry.Subscription, None ends the stream
+        connection = self.clients.get(client)
+        if connection is not None:
+            connection.subscription = subscription
+
+    def setbinary(self, client, enabled):
+        connection = self.clients.get(client)
+        if connection is not None:
+            connection.binary = bool(enabled)
+
+    def publish(self, t, values):
+        # hand a new sample to every subscriber, never waits for a socket
+        for client, connection in self.clients.items():
+            if connection.subscription is not None:
+                connection.subscription.offer(t, values)
+                self.flush(client)
+
+    def flush(self, client):
+        connection = self.clients.get(client)
+        if connection is None or connection.subscription is None:
+            return
+        out = drain(connection.subscription, connection.binary, connection.socket.bytesToWrite())
+        if out:
+            connection.socket.write(out)
+
+    def sendeasy(self, msg, client=None):
+        # reply to the client whose command is being handled unless told otherwise,
+        # msg is a string or a protocol.SampleBlock
+        if client is None:
+            client = self.current
+        connection = self.clients.get(client)
+        if connection is None:
+            return False
+        connection.socket.write(protocol.encode(msg, connection.binary))
+        return True
 
 
 class ServerSignals(QObject):
-    msg = pyqtSignal(str)
+    msg = pyqtSignal(int, str)
     response = pyqtSignal(str)
 
 
@@ -0,0 +1,223 @@
+# -------------------------------------------------------------------------------
+#  Data log - append-only binary record of samples and setpoint writes
+# -------------------------------------------------------------------------------
+#
+#  A log directory holds files coil-<date>-<time>.bin. Every file starts with
+#  a 16 byte header (magic, version, record size) followed by fixed size
+#  little endian records:
+#
+#  offset  type     field
+#       0  float64  t        time.time()
+#       8  float64  voltage  measured or set voltage (V), nan if not set
+#      16  float64  current  measured or set current (A), nan if not set
+#      24  uint8    kind     SAMPLE, SETCURRENT or SETVOLTAGE
+#      25  uint8    channel
+#      26  uint8    output   1 on, 0 off, 255 unknown
+#      27  5 bytes padding
+#
+#  A file is cut off at the last complete record, so a log that was not
+#  closed properly can still be read.
+
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+import numpy as np
+from logconfig import getlogger
+
+log = getlogger('datalog')
+
+MAGIC = b'COILLOG\0'
+VERSION = 1
+HEADER = struct.Struct('<8sII')
+
+RECORD = np.dtype({'names': ['t', 'voltage', 'current', 'kind', 'channel', 'output'],
+                   'formats': ['<f8', '<f8', '<f8', 'u1', 'u1', 'u1'],
+                   'offsets': [0, 8, 16, 24, 25, 26],
+                   'itemsize': 32})
+
+SAMPLE = 0
+SETCURRENT = 1
+SETVOLTAGE = 2
+UNKNOWN = 255
+
+LOGDIR = 'datalog'
+# a new file is started when the current one is this large (bytes) or old (s)
+MAXBYTES = 64 * 1024 * 1024
+MAXAGE = 6 * 3600
+# seconds between fsyncs
+FSYNC = 1.
+# records written per batch at most
+BATCH = 4096
+
+
+class DataLog:
+    """Writes records from a background thread.
+
+    samples() and setpoint() only put a tuple into a queue, so acquisition and
+    broker threads never wait for the disk. The writer thread packs whatever
+    has accumulated into one array, appends it with a single write and
+    fsyncs at most every fsync seconds.
+    """
+
+    def __init__(self, directory=LOGDIR, maxbytes=MAXBYTES, maxage=MAXAGE, fsync=FSYNC):
+        self.directory = directory
+        self.maxbytes = maxbytes
+        self.maxage = maxage
+        self.fsync = fsync
+        self.queue = queue.SimpleQueue()
+        self.file = None
+        self.path = None
+        self.opened = 0.
+        self.written = 0
+        self.thread = threading.Thread(target=self.run, name='DataLog', daemon=True)
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.thread.start()
+
+    def stop(self):
+        # everything queued before is still written
+        self.queue.put(None)
+        self.thread.join()
+
+    def samples(self, t, values):
+        # values as emitted by the acquisition: {channel: (voltage, current[, output on])}
+        for channel, v in values.items():
+            output = UNKNOWN if len(v) < 3 else int(v[2])
+            self.queue.put((t, v[0], v[1], SAMPLE, channel, output))
+
+    def setpoint(self, t, channel, current=None, voltage=None):
+        if current is not None:
+            self.queue.put((t, np.nan, current, SETCURRENT, channel, UNKNOWN))
+        if voltage is not None:
+            self.queue.put((t, voltage, np.nan, SETVOLTAGE, channel, UNKNOWN))
+
+    def run(self):
+        lastsync = time.monotonic()
+        running = True
+        while running:
+            try:
+                records = [self.queue.get(timeout=self.fsync)]
+            except queue.Empty:
+                records = []
+            while len(records) < BATCH:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in records:
+                records = records[:records.index(None)]
+                running = False
+            try:
+                if records:
+                    self.write(np.array(records, dtype=RECORD))
+                if self.file is not None and (not running or time.monotonic() - lastsync >= self.fsync):
+                    self.file.flush()
+                    os.fsync(self.file.fileno())
+                    lastsync = time.monotonic()
+            except OSError as e:
+                log.error('Data log error: %s', e)
+        self.close()
+
+    def write(self, records):
+        if self.file is None or self.written >= self.maxbytes or time.time() - self.opened >= self.maxage:
+            self.rotate()
+        self.file.write(records.tobytes())
+        self.written += records.nbytes
+
+    def rotate(self):
+        self.close()
+        self.opened = time.time()
+        name = time.strftime('coil-%Y%m%d-%H%M%S', time.localtime(self.opened))
+        path = os.path.join(self.directory, name + '.bin')
+        n = 1
+        while os.path.exists(path):
+            path = os.path.join(self.directory, '{}-{}.bin'.format(name, n))
+            n += 1
+        self.file = open(path, 'ab')
+        self.file.write(HEADER.pack(MAGIC, VERSION, RECORD.itemsize))
+        self.path = path
+        self.written = HEADER.size
+
+    def close(self):
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            self.file = None
+
+
+def readlog(path):
+    """Records of one log file as a read-only memory map"""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        magic, version, itemsize = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or itemsize != RECORD.itemsize:
+        raise ValueError('{} is not a coil data log'.format(path))
+    count = (size - HEADER.size) // RECORD.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=RECORD)
+    return np.memmap(path, dtype=RECORD, mode='r', offset=HEADER.size, shape=(count,))
+
+
+class LogReader:
+    """All files of a log directory, oldest first.
+
+    Files are mapped, not read; selecting a channel or a time range only
+    touches the pages it needs. Records are in write order, which is time
+    order up to the few ms between the acquisition and the broker thread.
+    """
+
+    def __init__(self, directory=LOGDIR):
+        self.directory = directory
+        self.logs = [readlog(os.path.join(directory, name))
+                     for name in os.listdir(directory) if name.endswith('.bin')]
+        # by the first record, files started within the same second only differ by a suffix
+        self.logs.sort(key=lambda log: log['t'][0] if len(log) else np.inf)
+
+    def records(self, t0=-np.inf, t1=np.inf):
+        parts = []
+        for log in self.logs:
+            if not len(log) or log['t'][0] >= t1 or log['t'][-1] < t0:
+                continue
+            lo, hi = np.searchsorted(log['t'], (t0, t1))
+            parts.append(log[lo:hi])
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=RECORD)
+
+    def samples(self, channel, t0=-np.inf, t1=np.inf):
+        # (time, voltage, current, output) of one channel
+        r = self.records(t0, t1)
+        r = r[(r['kind'] == SAMPLE) & (r['channel'] == channel)]
+        return r['t'], r['voltage'], r['current'], r['output']
+
+    def setpoints(self, channel, kind=SETCURRENT, t0=-np.inf, t1=np.inf):
+        r = self.records(t0, t1)
+        r = r[(r['kind'] == kind) & (r['channel'] == channel)]
+        return r['t'], r['current'] if kind == SETCURRENT else r['voltage']
+
+
+if __name__ == '__main__':
+    # python datalog.py [directory] - plot a whole log
+    import pyqtgraph as pg
+    from pyqtgraph.Qt import QtWidgets
+    app = QtWidgets.QApplication(sys.argv)
+    reader = LogReader(sys.argv[1] if len(sys.argv) > 1 else LOGDIR)
+    window = pg.GraphicsLayoutWidget(title='Coil data log')
+    volt = window.addPlot(row=0, col=0, title='Voltage', axisItems={'bottom': pg.DateAxisItem()})
+    curr = window.addPlot(row=1, col=0, title='Current', axisItems={'bottom': pg.DateAxisItem()})
+    curr.setXLink(volt)
+    for channel, color in zip((1, 2, 3), ('r', 'g', 'b')):
+        t, v, i, _ = reader.samples(channel)
+        for plot, y in ((volt, v), (curr, i)):
+            plot.setDownsampling(auto=True, mode='peak')
+            plot.setClipToView(True)
+            plot.plot(t, y, pen=pg.mkPen(color=color), name='CH{}'.format(channel))
+        t, s = reader.setpoints(channel)
+        curr.plot(t, s, pen=None, symbol='o', symbolSize=4, symbolBrush=color)
+    window.show()
+    sys.exit(app.exec_())
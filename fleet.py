@@ -0,0 +1,216 @@
+# -------------------------------------------------------------------------------
+#  Fleet - several PL-P supplies behind one channel address space
+# -------------------------------------------------------------------------------
+
+import json
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from plpbatch import opensupply
+from broker import DeviceBroker, SupplyProxy, PRIORITY_CONTROL, PRIORITY_MONITOR
+from telemetry import SPACING, addresstext
+from logconfig import getlogger
+
+log = getlogger('fleet')
+
+
+def parseresources(text):
+    # 'res1, res2' or 'res1;res2', a single resource is a fleet of one
+    return [r.strip() for r in re.split('[,;]', text) if r.strip()]
+
+
+class Member:
+    """One supply of the fleet with its own connection and DeviceBroker."""
+
+    def __init__(self, index, resource, channels=(1, 2, 3)):
+        self.index = index
+        self.resource = resource
+        self.base = SPACING * index
+        self.local = tuple(channels)
+        self.supply = None
+        self.broker = None
+        self.idn = ''
+
+    @property
+    def channels(self):
+        # fleet channel ids
+        return tuple(self.base + ch for ch in self.local)
+
+    def describe(self):
+        return {'supply': self.index + 1, 'resource': self.resource, 'idn': self.idn,
+                'channels': [addresstext(ch) for ch in self.channels]}
+
+    def connect(self, log=None):
+        supply = opensupply(self.resource)
+        supply.open()
+        try:
+            self.idn = supply.idn()
+        except Exception:
+            try:
+                supply.close()
+            except Exception:
+                pass
+            raise
+        # only a supply that answered is handed back to local control on disconnect
+        self.supply = supply
+        self.broker = DeviceBroker(self.supply)
+        self.broker.log = log
+        self.broker.base = self.base
+        self.broker.start()
+
+    def disconnect(self):
+        if self.broker is not None:
+            self.broker.stop()
+            self.broker = None
+        if self.supply is not None:
+            supply, self.supply = self.supply, None
+            try:
+                supply.setLocal()
+            finally:
+                supply.close()
+
+
+class Fleet:
+    """Supplies addressed by fleet channel ids (see telemetry.address).
+
+    Every supply has its own DeviceBroker thread, so calls on different
+    supplies run concurrently. Calls take the fleet channel id as channel
+    keyword and go to the broker of its supply with the local channel
+    number; measureAll is sent to all supplies at once and the replies are
+    merged. proxy() gives an object that looks like a single supply with
+    many channels, so ramps and the GUI work unchanged on a fleet.
+    """
+
+    def __init__(self, resources, log=None):
+        if isinstance(resources, str):
+            resources = parseresources(resources)
+        self.members = [Member(i, r) for i, r in enumerate(resources)]
+        self.log = log
+        self.pool = ThreadPoolExecutor(max_workers=max(len(self.members), 1), thread_name_prefix='Fleet')
+
+    def __len__(self):
+        return len(self.members)
+
+    @property
+    def channels(self):
+        return tuple(ch for m in self.members for ch in m.channels)
+
+    def connect(self):
+        # all supplies at once, if one fails the others are closed again
+        futures = [self.pool.submit(m.connect, self.log) for m in self.members]
+        errors = [f.exception() for f in futures]
+        failed = [(m, e) for m, e in zip(self.members, errors) if e is not None]
+        if failed:
+            self.disconnect()
+            raise RuntimeError('; '.join('{}: {}'.format(m.resource, e) for m, e in failed))
+        return [m.idn for m in self.members]
+
+    def disconnect(self):
+        # every member is disconnected, errors are only logged
+        futures = [self.pool.submit(m.disconnect) for m in self.members]
+        for member, future in zip(self.members, futures):
+            if future.exception() is not None:
+                log.warning('Disconnecting %s failed: %s', member.resource, future.exception())
+
+    def member(self, channel):
+        # (member, local channel) of a fleet channel id
+        index, local = divmod(channel, SPACING)
+        if index >= len(self.members) or local not in self.members[index].local:
+            raise ValueError('no channel {}'.format(addresstext(channel)))
+        return self.members[index], local
+
+    def submit(self, method, *args, priority=PRIORITY_CONTROL, channel=None, **kwargs):
+        if method == 'measureAll':
+            return self.measure(*args, priority=priority, **kwargs)
+        if method == 'setCurrents':
+            return self.setcurrents(*args, priority=priority)
+        if channel is None:
+            # calls without a channel go to the first supply
+            return self.members[0].broker.submit(method, *args, priority=priority, **kwargs)
+        member, local = self.member(channel)
+        return member.broker.submit(method, *args, priority=priority, channel=local, **kwargs)
+
+    def call(self, method, *args, priority=PRIORITY_CONTROL, channel=None, **kwargs):
+        if method in ('measureAll', 'setCurrents'):
+            return self.submit(method, *args, priority=priority, **kwargs).result()
+        if channel is None:
+            return self.members[0].broker.call(method, *args, priority=priority, **kwargs)
+        member, local = self.member(channel)
+        return member.broker.call(method, *args, priority=priority, channel=local, **kwargs)
+
+    def measure(self, channels=None, outputs=False, priority=PRIORITY_MONITOR):
+        """Future of {channel id: (voltage, current[, output on])} over all supplies"""
+        if channels is None:
+            channels = self.channels
+        parts = {member: member.broker.submit('measureAll', tuple(local), outputs, priority=priority)
+                 for member, local in self.group(channels).items()}
+
+        def merge(results):
+            values = {}
+            for member, (reply, _) in results.items():
+                values.update((member.base + ch, v) for ch, v in reply.items())
+            return values
+
+        return gather(parts, merge)
+
+    def setcurrents(self, currents, priority=PRIORITY_CONTROL):
+        """Set {channel id: current}, one message per supply and all supplies at once.
+
+        The future gives {supply index: time.monotonic() the write finished}, the
+        spread of these times is the skew between the supplies.
+        """
+        groups = self.group(currents)
+        parts = {member: member.broker.submit('setCurrents', {ch: currents[member.base + ch] for ch in local},
+                                              priority=priority)
+                 for member, local in groups.items()}
+        return gather(parts, lambda results: {member.index: t for member, (_, t) in results.items()})
+
+    def group(self, channels):
+        # {member: [local channel, ...]} in the order of channels
+        groups = {}
+        for channel in channels:
+            member, local = self.member(channel)
+            groups.setdefault(member, []).append(local)
+        return groups
+
+    def proxy(self, priority=PRIORITY_CONTROL):
+        return SupplyProxy(self, priority)
+
+    def listing(self):
+        return json.dumps([m.describe() for m in self.members])
+
+
+def gather(parts, merge):
+    """One future for {key: future}.
+
+    It gets merge({key: (result, time.monotonic() when done)}) once every
+    part is done, or the first exception.
+    """
+    result = Future()
+    result.set_running_or_notify_cancel()
+    finished = {}
+    lock = threading.Lock()
+
+    def done(key, future):
+        # runs on the broker thread that finishes the part
+        t = time.monotonic()
+        with lock:
+            if result.done():
+                return
+            if future.exception() is not None:
+                result.set_exception(future.exception())
+                return
+            finished[key] = (future.result(), t)
+            if len(finished) < len(parts):
+                return
+        try:
+            result.set_result(merge(finished))
+        except Exception as e:
+            result.set_exception(e)
+
+    if not parts:
+        result.set_result(merge({}))
+    for key, future in parts.items():
+        future.add_done_callback(lambda f, key=key: done(key, f))
+    return result
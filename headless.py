@@ -0,0 +1,318 @@
+# -------------------------------------------------------------------------------
+#  Headless control service - the remote command set without Qt
+# -------------------------------------------------------------------------------
+
+import argparse
+import asyncio
+import time
+from os import environ
+from broker import PRIORITY_CONTROL, PRIORITY_MONITOR, PRIORITY_RAMP
+from fleet import Fleet
+from ramp import RampExecutor, CoordinatedRamp
+from samplebuffer import SampleBuffer
+from telemetry import Subscription
+from remote import SampleStore, PollFailures, drain
+import protocol
+import trajectory
+from commands import CommandRegistry, CommandError, SPEC, BADARGS, FAILED
+from datalog import DataLog, LOGDIR
+from metrics import METRICS
+from logconfig import getlogger, setup as setuplogging, LEVEL
+
+log = getlogger('headless')
+ramplog = getlogger('ramp')
+
+RESOURCE = 'TCPIP0::169.254.70.222::9221::SOCKET'
+HOST = '127.0.0.1'
+PORT = 65432
+# bytes read from a client at a time
+READSIZE = 65536
+# samples kept per channel for get_samples
+HISTORY = 10000
+
+
+class ControlService:
+    """Drives the supplies and the ramp engine directly and serves the remote
+    command set of the GUI over TCP (newline terminated, persistent connections).
+    resource may list several supplies separated by ',', they form one Fleet.
+    """
+
+    def __init__(self, resource, interval=0.01, logdir=LOGDIR):
+        self.resource = resource
+        self.interval = interval  # s
+        # '' for no data log
+        self.logdir = logdir
+        self.datalog = None
+        self.channel = 1
+        self.channels = ()  # all channel ids of the fleet once connected
+        # same defaults as the smooth ramp tab, the limits are checked by the command grammar
+        self.smoothtarget = 1.0
+        self.smoothrate = 1.0
+        self.smoothdwell = 100
+        self.rampTolerance = 0.
+        self.samples = SampleStore(maxage=0.5)
+        self.subscriptions = {}
+        # connections that switched to protocol frames
+        self.binaryclients = set()
+        self.ramp = None
+        self.fleet = None
+        self.commands = CommandRegistry()
+        # display commands have no handler here
+        self.commands.bind({name: getattr(self, name) for name, _, _ in SPEC if hasattr(self, name)})
+
+    def connect(self):
+        log.info('Connecting to %s', self.resource)
+        if self.logdir:
+            self.datalog = DataLog(self.logdir)
+            self.datalog.start()
+        fleet = Fleet(self.resource, self.datalog)
+        for idn in fleet.connect():
+            log.info(idn)
+        self.fleet = fleet
+        self.channels = fleet.channels
+        self.samples.reset(SampleBuffer(HISTORY, self.channels, time.time()))
+
+    def disconnect(self):
+        if self.ramp is not None and self.ramp.running:
+            self.ramp.abort()
+            self.ramp.wait()
+        if self.fleet is not None:
+            self.fleet.disconnect()
+            self.fleet = None
+            self.samples.latest.clear()
+        if self.datalog is not None:
+            self.datalog.stop()
+            log.info('Data logged to %s', self.datalog.path)
+            self.datalog = None
+        log.info('Disconnecting from %s', self.resource)
+
+    async def device(self, method, *args, priority=PRIORITY_CONTROL, **kwargs):
+        # await a broker call without blocking the event loop
+        if self.fleet is None:
+            raise CommandError(FAILED, 'not connected')
+        return await asyncio.wrap_future(self.fleet.submit(method, *args, priority=priority, **kwargs))
+
+    async def poll(self):
+        deadline = time.monotonic()
+        failures = PollFailures()
+        while True:
+            start = time.perf_counter()
+            try:
+                t = time.time()
+                values = await self.device('measureAll', self.channels, self.datalog is not None,
+                                           priority=PRIORITY_MONITOR)
+                if self.datalog is not None:
+                    self.datalog.samples(t, values)
+                self.samples.append(t, values)
+                self.publish(t, values)
+                count = failures.succeeded()
+                if count:
+                    log.info('Acquisition recovered after %d failed polls', count)
+            except Exception as e:
+                message = failures.failed(e)
+                if message is not None:
+                    log.error('Acquisition error: %s', message)
+            if METRICS.enabled:
+                cost = time.perf_counter() - start
+                METRICS.record('acquisition.poll', cost)
+                if cost > self.interval:
+                    METRICS.overrun('acquisition.poll')
+            deadline = max(deadline + failures.interval(self.interval), time.monotonic())
+            await asyncio.sleep(deadline - time.monotonic())
+
+    def publish(self, t, values):
+        for writer, subscription in list(self.subscriptions.items()):
+            if writer.transport.is_closing():
+                # gone, handle cleans up once its read fails
+                continue
+            subscription.offer(t, values)
+            self.flush(writer, subscription)
+
+    def flush(self, writer, subscription):
+        # never waits, what does not fit stays queued (and drops oldest first)
+        out = drain(subscription, writer in self.binaryclients, writer.transport.get_write_buffer_size())
+        if out:
+            writer.write(out)
+
+    def subscribe(self, writer, channels, rate):
+        self.subscriptions[writer] = Subscription(channels, rate)
+        return 'Done!'
+
+    def unsubscribe(self, writer):
+        self.subscriptions.pop(writer, None)
+        return 'Done!'
+
+    def set_acquisitioninterval(self, interval):
+        # picked up by the poll loop after the current wait
+        self.interval = interval / 1000.
+        return 'Done!'
+
+    def get_samples(self, channel, count):
+        return self.samples.samples(channel, count)
+
+    def get_history(self, channel, t0, t1, buckets, mode):
+        return self.samples.history(channel, t0, t1, buckets, mode)
+
+    def binary(self, writer, enabled):
+        # the reply is already sent in the new mode
+        if enabled:
+            self.binaryclients.add(writer)
+        else:
+            self.binaryclients.discard(writer)
+        return 'Done!'
+
+    async def handle(self, reader, writer):
+        lines = protocol.LineBuffer()
+        try:
+            while True:
+                data = await reader.read(READSIZE)
+                if not data:
+                    break
+                for line in lines.feed(data):
+                    if line is None:
+                        writer.write(protocol.encode(protocol.TOOLONG, writer in self.binaryclients))
+                        continue
+                    s = line.decode('utf-8', errors='replace').strip()
+                    if not s:
+                        continue
+                    reply = await self.commands.dispatchasync(s, writer)
+                    writer.write(protocol.encode(reply, writer in self.binaryclients))
+                await writer.drain()
+        except (ConnectionError, OSError) as e:
+            log.info('Client dropped: %s', e)
+        finally:
+            self.subscriptions.pop(writer, None)
+            self.binaryclients.discard(writer)
+            writer.close()
+
+    def list_supplies(self):
+        return self.fleet.listing()
+
+    def get_metrics(self, reset):
+        reply = METRICS.json()
+        if reset:
+            METRICS.reset()
+        return reply
+
+    async def get_volt(self, channel):
+        return str((await self.measured(channel))[1])
+
+    async def get_curr(self, channel):
+        return str((await self.measured(channel))[2])
+
+    async def measured(self, channel):
+        # (time, voltage, current) from the poll loop, one device query if that is too old
+        sample = self.samples.cached(channel)
+        if sample is None:
+            t = time.time()
+            sample = self.samples.measured(channel, t, await self.device('measureAll', (channel,)))
+        return sample
+
+    def set_channel(self, channel):
+        self.samples.check(channel)
+        self.channel = channel
+        return 'Done!'
+
+    async def set_output(self, channel, state):
+        self.samples.check(channel)
+        if state == 1:
+            await self.device('outputOn', channel=channel)
+            return 'Done! ON'
+        await self.device('outputOff', channel=channel)
+        return 'Done! OFF'
+
+    async def set_current(self, channel, current):
+        self.samples.check(channel)
+        await self.device('setCurrent', current, channel=channel)
+        return 'Done!'
+
+    def set_smoothtarget(self, current):
+        self.smoothtarget = current
+        return 'Done!'
+
+    def set_smoothrate(self, rate):
+        self.smoothrate = rate
+        return 'Done!'
+
+    def set_smoothdwell(self, dwell):
+        self.smoothdwell = dwell
+        return 'Done!'
+
+    def pause_ramp(self):
+        if self.ramp is not None:
+            self.ramp.pause()
+        return 'Done!'
+
+    def resume_ramp(self):
+        if self.ramp is not None:
+            self.ramp.resume()
+        return 'Done!'
+
+    def abort_ramp(self):
+        if self.ramp is not None:
+            self.ramp.abort()
+        return 'Done!'
+
+    async def start_smoothramp(self):
+        if self.ramp is not None and self.ramp.running:
+            raise CommandError(FAILED, 'ramp already running')
+        ramplog.info('Starting smooth ramp (remote)')
+        currentnow = await self.device('measureCurrent', channel=self.channel)
+        dwell, points, _ = trajectory.trajectory(currentnow, self.smoothtarget, self.smoothrate / 60.,
+                                                 self.smoothdwell / 1000., 'smooth')
+        points, holds = trajectory.compress(points, dwell, self.rampTolerance)
+        self.ramp = RampExecutor(self.fleet.proxy(PRIORITY_RAMP), points, holds, channel=self.channel,
+                                 onfinished=lambda ramp: ramplog.info('Finished ramp: %s', ramp.report()))
+        self.ramp.start()
+        return 'Done!'
+
+    async def start_coordinatedramp(self, channels, targets):
+        if len(channels) != len(targets):
+            raise CommandError(BADARGS, 'one target per channel')
+        for channel in channels:
+            self.samples.check(channel)
+        if self.ramp is not None and self.ramp.running:
+            raise CommandError(FAILED, 'ramp already running')
+        ramplog.info('Starting coordinated ramp (remote)')
+        values = await self.device('measureAll', channels)
+        dwell, points, _ = trajectory.coordinated([values[ch][1] for ch in channels], targets,
+                                                  self.smoothrate / 60., self.smoothdwell / 1000., 'smooth')
+        points, holds = trajectory.compress(points, dwell, self.rampTolerance)
+        self.ramp = CoordinatedRamp(self.fleet.proxy(PRIORITY_RAMP), points, holds, channels,
+                                    onfinished=lambda ramp: ramplog.info('Finished ramp: %s', ramp.report()))
+        self.ramp.start()
+        return 'Done!'
+
+    async def serve(self, host=HOST, port=PORT):
+        self.connect()
+        poller = asyncio.ensure_future(self.poll())
+        server = await asyncio.start_server(self.handle, host, port)
+        log.info('Listening on %s:%d', host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            poller.cancel()
+            self.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless coil control service')
+    parser.add_argument('--resource', default=environ.get('aimtti', RESOURCE), help='VISA resource of the supply, SIM:: for a simulated one')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--interval', type=float, default=10, help='acquisition interval in ms')
+    parser.add_argument('--logdir', default=environ.get('coillog', LOGDIR), help='data log directory, "" for none')
+    parser.add_argument('--loglevel', default=environ.get('coilloglevel', LEVEL),
+                        help='e.g. INFO or DEBUG,ramp=INFO, see logconfig.py')
+    args = parser.parse_args()
+    setuplogging(args.loglevel)
+    service = ControlService(args.resource, args.interval / 1000., args.logdir)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        log.info('Ending service - byeeee')
+
+
+if __name__ == '__main__':
+    main()
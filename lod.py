@@ -0,0 +1,105 @@
+# -------------------------------------------------------------------------------
+#  Level of detail for long histories - min/max pyramid over a ring buffer
+# -------------------------------------------------------------------------------
+
+import numpy as np
+from samplebuffer import RingBuffer
+
+# raw samples per block of the first level, blocks per block of the next ones
+FACTOR = 4
+# no level with fewer blocks than this
+MINLEVEL = 64
+
+
+class Level:
+    def __init__(self, capacity):
+        self.time = RingBuffer(capacity)  # time of the first sample of every block
+        self.min = RingBuffer(capacity)
+        self.max = RingBuffer(capacity)
+
+    def append(self, t, lo, hi):
+        self.time.append(t)
+        self.min.append(lo)
+        self.max.append(hi)
+
+    def clear(self):
+        self.time.clear()
+        self.min.clear()
+        self.max.clear()
+
+
+class MinMaxPyramid:
+    """Min and max of blocks of FACTOR, FACTOR**2, ... samples of one series.
+
+    The raw samples stay in the ring buffers passed in (e.g. a ChannelBuffer's
+    time and current), the pyramid only keeps the block extremes and covers
+    about the same span of time. append() has to be called for every sample
+    after it went into the ring buffers and costs O(1) amortized.
+
+    select() returns at most about 2 * pixels points for any visible range:
+    the raw samples if there are few enough, else the min/max envelope of the
+    finest level that fits, drawn as a zigzag line through both extremes so
+    no spike gets lost.
+    """
+
+    def __init__(self, time, values, factor=FACTOR):
+        self.time = time
+        self.values = values
+        self.factor = factor
+        self.levels = []
+        capacity = time.capacity // factor
+        while capacity >= MINLEVEL:
+            self.levels.append(Level(capacity + 1))
+            capacity //= factor
+        # unfinished block per level: [time, min, max, count]
+        self.partial = [None] * len(self.levels)
+
+    def append(self, t, value):
+        self.push(0, t, value, value)
+
+    def push(self, k, t, lo, hi):
+        if k == len(self.levels):
+            return
+        p = self.partial[k]
+        if p is None:
+            p = self.partial[k] = [t, lo, hi, 0]
+        else:
+            p[1] = min(p[1], lo)
+            p[2] = max(p[2], hi)
+        p[3] += 1
+        if p[3] == self.factor:
+            self.levels[k].append(p[0], p[1], p[2])
+            self.partial[k] = None
+            self.push(k + 1, p[0], p[1], p[2])
+
+    def clear(self):
+        for level in self.levels:
+            level.clear()
+        self.partial = [None] * len(self.levels)
+
+    def select(self, x0=-np.inf, x1=np.inf, pixels=1000):
+        t = self.time.view()
+        lo, hi = np.searchsorted(t, (x0, x1))
+        # one sample beyond each edge so the line runs out of the view
+        lo, hi = max(lo - 1, 0), min(hi + 1, len(t))
+        n = hi - lo
+        if n <= 2 * pixels or not self.levels:
+            return t[lo:hi], self.values.view()[lo:hi]
+        k = 0
+        size = self.factor
+        while k < len(self.levels) - 1 and n / size > pixels:
+            k += 1
+            size *= self.factor
+        level = self.levels[k]
+        lt = level.time.view()
+        lo, hi = np.searchsorted(lt, (x0, x1))
+        lo, hi = max(lo - 1, 0), min(hi + 1, len(lt))
+        times, mins, maxs = [lt[lo:hi]], [level.min.view()[lo:hi]], [level.max.view()[lo:hi]]
+        if hi == len(lt):
+            # the newest samples are not in a complete block of this level yet
+            tail = [p for p in self.partial[k::-1] if p is not None]
+            times.append([p[0] for p in tail])
+            mins.append([p[1] for p in tail])
+            maxs.append([p[2] for p in tail])
+        times, mins, maxs = np.concatenate(times), np.concatenate(mins), np.concatenate(maxs)
+        return np.repeat(times, 2), np.column_stack((mins, maxs)).ravel()
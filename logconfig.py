@@ -0,0 +1,80 @@
+# -------------------------------------------------------------------------------
+#  Logging - per-subsystem loggers written by a background thread
+# -------------------------------------------------------------------------------
+#
+#  Every module logs to coil.<subsystem>: gui, ramp, server, commands,
+#  datalog, fleet, headless, telemetry. The calling thread only puts the record into a queue,
+#  a QueueListener formats it and writes it to a rotating file and the
+#  console. Records below the level of their logger are dropped before that.
+#
+#  The level is a default, optionally followed by per-subsystem levels:
+#  'INFO,server=DEBUG,gui=WARNING', from the environment variable
+#  coilloglevel unless given. Files go to coillogdir (default logs), ''
+#  logs to the console only.
+#
+#  Without setup() the loggers fall back to Python's default: warnings and
+#  errors on stderr.
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+from os import environ
+
+LOGDIR = 'logs'
+LOGFILE = 'coilcontrol.log'
+MAXBYTES = 10 * 1024 * 1024
+BACKUPS = 5
+LEVEL = 'INFO'
+FORMAT = '%(asctime)s %(levelname)-7s %(name)-14s %(threadName)s: %(message)s'
+CONSOLEFORMAT = '%(levelname)-7s %(name)s: %(message)s'
+
+_listener = None
+
+
+def getlogger(subsystem):
+    return logging.getLogger('coil.' + subsystem)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    # the record is passed on as it is, formatting happens on the listener thread
+    def prepare(self, record):
+        return record
+
+
+def setlevels(levels):
+    for item in filter(None, levels.split(',')):
+        name, _, level = item.rpartition('=')
+        name = name.strip()
+        if name and not name.startswith('coil'):
+            name = 'coil.' + name
+        logging.getLogger(name or 'coil').setLevel(level.strip().upper())
+
+
+def setup(levels=None, directory=None, filename=LOGFILE, console=True):
+    """Start the pipeline, once per process. Returns the QueueListener, stopped at exit."""
+    global _listener
+    if _listener is not None:
+        return _listener
+    directory = environ.get('coillogdir', LOGDIR) if directory is None else directory
+    handlers = []
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(os.path.join(directory, filename), maxBytes=MAXBYTES,
+                                                       backupCount=BACKUPS, encoding='utf-8')
+        handler.setFormatter(logging.Formatter(FORMAT))
+        handlers.append(handler)
+    if console:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(CONSOLEFORMAT))
+        handlers.append(handler)
+    setlevels(environ.get('coilloglevel', LEVEL) if levels is None else levels)
+    records = queue.SimpleQueue()
+    root = logging.getLogger('coil')
+    root.addHandler(_QueueHandler(records))
+    root.propagate = False
+    _listener = logging.handlers.QueueListener(records, *handlers)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
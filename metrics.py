@@ -0,0 +1,151 @@
+# -------------------------------------------------------------------------------
+#  Metrics - timings, counters and overruns of the hot paths
+# -------------------------------------------------------------------------------
+#
+#  Names are '<subsystem>.<what>': supply.<method> (I/O time of a broker
+#  call), broker.wait (time in the queue), acquisition.poll, plot.frame,
+#  ramp.write, ramp.late and command.<name>. Timers keep a histogram with
+#  PERDECADE logarithmic buckets per decade from MINIMUM up, so percentiles
+#  are exact to about 25 % at a fixed cost per sample. An overrun is a step
+#  that took longer than its budget, e.g. a poll longer than the acquisition
+#  interval or a skipped ramp point.
+#
+#  Recording is switched off with the environment variable coilmetrics=0 or
+#  METRICS.enabled = False; every instrumented spot then only checks that flag.
+
+import json
+import math
+import threading
+import time
+from contextlib import nullcontext
+from os import environ
+
+MINIMUM = 1e-6  # s, lower edge of the second bucket
+DECADES = 8
+PERDECADE = 10
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (DECADES * PERDECADE + 2)
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, seconds):
+        if seconds < MINIMUM:
+            i = 0
+        else:
+            i = min(int(math.log10(seconds / MINIMUM) * PERDECADE) + 1, len(self.counts) - 1)
+        self.counts[i] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        # upper edge of the bucket the q-th percentile falls in, never above the maximum
+        rank = q / 100. * self.count
+        running = 0
+        for i, c in enumerate(self.counts):
+            running += c
+            if c and running >= rank:
+                return min(MINIMUM * 10 ** (i / PERDECADE), self.max)
+        return self.max
+
+    def snapshot(self):
+        # milliseconds
+        return {'count': self.count,
+                'mean': self.total / self.count * 1000 if self.count else 0.,
+                'p50': self.percentile(50) * 1000,
+                'p99': self.percentile(99) * 1000,
+                'max': self.max * 1000}
+
+
+class Timer:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+
+
+NOTIMER = nullcontext()
+
+
+class Metrics:
+    """Timers, counters and overruns shared by all threads.
+
+    record() adds a duration in seconds, timer() times a with block,
+    count() and overrun() add to a counter. snapshot() gives everything
+    since the start or the last reset() as a dict with times in ms.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.timers = {}
+        self.counters = {}
+        self.overruns = {}
+        self.since = time.time()
+
+    def record(self, name, seconds):
+        with self.lock:
+            histogram = self.timers.get(name)
+            if histogram is None:
+                histogram = self.timers[name] = Histogram()
+            histogram.add(seconds)
+
+    def timer(self, name):
+        return Timer(self, name) if self.enabled else NOTIMER
+
+    def count(self, name, n=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def overrun(self, name, n=1):
+        if self.enabled:
+            with self.lock:
+                self.overruns[name] = self.overruns.get(name, 0) + n
+
+    def reset(self):
+        with self.lock:
+            self.timers.clear()
+            self.counters.clear()
+            self.overruns.clear()
+            self.since = time.time()
+
+    def snapshot(self):
+        with self.lock:
+            return {'enabled': self.enabled,
+                    'since': self.since,
+                    'timers': {name: h.snapshot() for name, h in sorted(self.timers.items())},
+                    'counters': dict(sorted(self.counters.items())),
+                    'overruns': dict(sorted(self.overruns.items()))}
+
+    def json(self):
+        return json.dumps(self.snapshot())
+
+    def text(self):
+        # table for the GUI panel
+        s = self.snapshot()
+        lines = ['{:28s} {:>8s} {:>9s} {:>9s} {:>9s}'.format('timer (ms)', 'count', 'p50', 'p99', 'max')]
+        for name, t in s['timers'].items():
+            lines.append('{:28s} {:8d} {:9.3f} {:9.3f} {:9.3f}'.format(name, t['count'], t['p50'], t['p99'], t['max']))
+        for title in ('counters', 'overruns'):
+            if s[title]:
+                lines.append('')
+                lines.append(title)
+                lines.extend('{:28s} {:8d}'.format(name, n) for name, n in s[title].items())
+        return '\n'.join(lines)
+
+
+METRICS = Metrics(environ.get('coilmetrics', '1') != '0')
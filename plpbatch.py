@@ -0,0 +1,67 @@
+# -------------------------------------------------------------------------------
+#  Batched measurements for Aim TTi PL-P supplies - one round-trip for all channels
+# -------------------------------------------------------------------------------
+
+import re
+from dcps import AimTTiPLP
+
+MEASURE_RE = re.compile(r'^\s*([0-9.+-]+)\s*([^\s]*)')
+# resources of simulated supplies, see simsupply.py
+SIMPREFIX = 'SIM::'
+
+
+class BatchedPLP(AimTTiPLP):
+    """AimTTiPLP with compound queries.
+
+    queryBatch() joins several queries with ';' into one message and splits
+    the reply, so e.g. V, I and output state of all three channels cost a
+    single round-trip instead of nine. setCurrents() does the same for
+    writes.
+    """
+
+    def queryBatch(self, queries):
+        reply = self._instQuery(';'.join(queries))
+        fields = [f.strip() for f in reply.split(';')]
+        # some firmware answers every query with its own line
+        while len(fields) < len(queries):
+            fields += [f.strip() for f in self._inst.read().split(';')]
+        if len(fields) != len(queries):
+            raise RuntimeError('Unexpected response to "{}": "{}"'.format(';'.join(queries), reply))
+        return fields
+
+    def setCurrents(self, currents):
+        """Set {channel: current} with a single message, all channels change together"""
+        self._instWrite(';'.join('I{} {}'.format(ch, current) for ch, current in currents.items()))
+
+    def measureAll(self, channels=(1, 2, 3), outputs=False):
+        """Return {channel: (voltage, current)} or {channel: (voltage, current, output on)}"""
+        queries = []
+        for ch in channels:
+            queries += ['V{}O?'.format(ch), 'I{}O?'.format(ch)]
+            if outputs:
+                queries.append('OP{}?'.format(ch))
+        fields = iter(self.queryBatch(queries))
+        result = {}
+        for ch in channels:
+            values = (parsemeasure(next(fields), 'V'), parsemeasure(next(fields), 'A'))
+            if outputs:
+                values += (next(fields)[:1] == '1',)
+            result[ch] = values
+        return result
+
+
+def parsemeasure(field, unit):
+    match = MEASURE_RE.match(field)
+    if match is None or match.group(2) != unit:
+        raise RuntimeError('Unexpected response: "{}"'.format(field))
+    return float(match.group(1))
+
+
+def opensupply(resource):
+    # the driver for a resource, simulated for SIM:: resources. Writes return right away
+    # (dcps sleeps 1 s after each by default), the broker queue already keeps them in order
+    # and a sleep there would hold up acquisition and ramps
+    if resource.startswith(SIMPREFIX):
+        from simsupply import SimulatedPLP
+        return SimulatedPLP(resource, wait=0)
+    return BatchedPLP(resource, wait=0)
@@ -0,0 +1,137 @@
+# -------------------------------------------------------------------------------
+#  Binary framing for the command server
+# -------------------------------------------------------------------------------
+#
+#  After "binary:1" every message the server sends on that connection is a
+#  frame: a little endian header (uint32 payload length, uint8 frame type)
+#  followed by the payload. The reply to "binary" itself already uses the new
+#  mode. Commands are still sent as text lines.
+#
+#  TEXT     payload is the utf-8 reply without newline
+#  SAMPLES  payload is uint32 n followed by four float64 arrays of length n:
+#           time (time.time()), channel, voltage, current. The channel is
+#           10 * supply index + channel, i.e. 1, 2, 3 on the first supply
+#
+#  In text mode the same replies are newline terminated lines, a SampleBlock
+#  becomes one line of ';' separated <time>,<channel>,<voltage>,<current>.
+#
+#  Commands longer than MAXLINE are discarded up to their newline and answered
+#  with TOOLONG, see LineBuffer.
+
+import struct
+import numpy as np
+from telemetry import addresstext
+
+HEADER = struct.Struct('<IB')
+COUNT = struct.Struct('<I')
+TEXT = 0
+SAMPLES = 1
+# bytes per sample in a SAMPLES frame
+SAMPLESIZE = 32
+# longest command line accepted
+MAXLINE = 4096
+TOOLONG = 'Line-Too-Long!'
+
+
+class LineBuffer:
+    """Splits the bytes received on a connection into command lines.
+
+    feed() returns the complete lines and keeps the rest for the next call.
+    None in the list marks a line longer than MAXLINE. Such a line is dropped
+    as a whole, up to its newline, also when that only arrives later.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.discarding = False
+
+    def feed(self, data):
+        self.buffer += data
+        lines = []
+        start = 0
+        if self.discarding:
+            end = self.buffer.find(b'\n')
+            if end == -1:
+                self.buffer.clear()
+                return lines
+            start = end + 1
+            self.discarding = False
+        while True:
+            end = self.buffer.find(b'\n', start)
+            if end == -1:
+                break
+            # a long line may arrive with its newline in the same segment
+            lines.append(bytes(self.buffer[start:end]).rstrip(b'\r') if end - start <= MAXLINE else None)
+            start = end + 1
+        del self.buffer[:start]
+        if len(self.buffer) > MAXLINE:
+            self.buffer.clear()
+            self.discarding = True
+            lines.append(None)
+        return lines
+
+
+class SampleBlock:
+    """Samples returned by a command handler, sent as one SAMPLES frame in
+    binary mode and as one text line otherwise."""
+
+    def __init__(self, t, channel, volt, curr):
+        self.t = t
+        self.channel = channel
+        self.volt = volt
+        self.curr = curr
+
+    def __len__(self):
+        return len(self.t)
+
+    def frame(self):
+        return sampleframe(self.t, self.channel, self.volt, self.curr)
+
+    def text(self):
+        return ';'.join('{:.6f},{},{},{}'.format(t, addresstext(ch), v, i)
+                        for t, ch, v, i in zip(self.t, self.channel, self.volt, self.curr))
+
+
+def frame(kind, payload):
+    return HEADER.pack(len(payload), kind) + payload
+
+
+def textframe(msg):
+    return frame(TEXT, bytes(msg, 'utf-8'))
+
+
+def sampleframe(t, channel, volt, curr):
+    columns = [np.ascontiguousarray(a, dtype='<f8') for a in (t, channel, volt, curr)]
+    n = len(columns[0])
+    return frame(SAMPLES, COUNT.pack(n) + b''.join(c.tobytes() for c in columns))
+
+
+def samplerows(rows):
+    # frame from (time, channel, voltage, current) tuples as queued by telemetry.Subscription
+    a = np.array(rows, dtype='<f8').reshape(-1, 4)
+    return sampleframe(a[:, 0], a[:, 1], a[:, 2], a[:, 3])
+
+
+def encode(reply, binary):
+    # bytes to send for a handler reply (str or SampleBlock) in the mode of the connection
+    if isinstance(reply, SampleBlock):
+        return reply.frame() if binary else bytes(reply.text() + '\n', 'utf-8')
+    return textframe(reply) if binary else bytes(reply + '\n', 'utf-8')
+
+
+def readframe(buffer):
+    """Split the first complete frame off a bytes buffer: (kind, payload, rest) or None"""
+    if len(buffer) < HEADER.size:
+        return None
+    length, kind = HEADER.unpack_from(buffer)
+    end = HEADER.size + length
+    if len(buffer) < end:
+        return None
+    return kind, buffer[HEADER.size:end], buffer[end:]
+
+
+def unpacksamples(payload):
+    """(time, channel, voltage, current) arrays of a SAMPLES payload, without copying"""
+    n, = COUNT.unpack_from(payload)
+    a = np.frombuffer(payload, dtype='<f8', count=4 * n, offset=COUNT.size).reshape(4, n)
+    return a[0], a[1], a[2], a[3]
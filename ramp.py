@@ -0,0 +1,166 @@
+# -------------------------------------------------------------------------------
+#  Ramp executor - writes setpoints against absolute deadlines
+# -------------------------------------------------------------------------------
+
+import threading
+import time
+import numpy as np
+from metrics import METRICS
+from logconfig import getlogger
+
+log = getlogger('ramp')
+
+CATCHUP = 'catchup'  # late points are written back-to-back until on schedule again
+SKIP = 'skip'  # late points are dropped, the newest due point is written
+
+
+class RampExecutor:
+    """Writes a list of current setpoints, point i at t0 + i * dwell.
+
+    dwell is either one time for all points or the hold time of every point,
+    as returned by trajectory.compress. Deadlines are absolute (time.monotonic), so the I/O time of a write does
+    not add to the dwell and a long ramp finishes on time. The ramp runs in
+    its own thread and can be paused, resumed and aborted. The time spent
+    paused moves all later deadlines. The last point is never skipped.
+    """
+
+    def __init__(self, supply, points, dwell, channel=1, policy=SKIP, onfinished=None):
+        if policy not in (CATCHUP, SKIP):
+            raise ValueError('Unknown late policy: {}'.format(policy))
+        self.supply = supply
+        self.points = points
+        self.holds = np.broadcast_to(np.asarray(dwell, dtype=float), (len(points),))
+        # planned write time of every point relative to the start
+        self.times = np.concatenate(([0.], np.cumsum(self.holds)[:-1]))
+        self.channel = channel
+        self.policy = policy
+        self.onfinished = onfinished
+        self.index = 0
+        self.skipped = 0
+        self.planned = []
+        self.achieved = []
+        self.aborted = False
+        # the exception that stopped the ramp, if a write failed
+        self.error = None
+        self.resumed = threading.Event()
+        self.resumed.set()
+        self.wakeup = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='RampExecutor', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def pause(self):
+        self.resumed.clear()
+        self.wakeup.set()
+
+    def resume(self):
+        self.resumed.set()
+        self.wakeup.set()
+
+    def abort(self):
+        self.aborted = True
+        self.resumed.set()
+        self.wakeup.set()
+
+    def wait(self, timeout=None):
+        self.thread.join(timeout)
+
+    @property
+    def running(self):
+        return self.thread.is_alive()
+
+    @property
+    def paused(self):
+        return not self.resumed.is_set()
+
+    def run(self):
+        n = len(self.points)
+        t0 = time.monotonic()
+        try:
+            while self.index < n and not self.aborted:
+                if not self.resumed.is_set():
+                    pausestart = time.monotonic()
+                    self.resumed.wait()
+                    t0 += time.monotonic() - pausestart
+                    continue
+                deadline = t0 + self.times[self.index]
+                now = time.monotonic()
+                if now < deadline:
+                    # woken early on pause and abort
+                    self.wakeup.wait(deadline - now)
+                    self.wakeup.clear()
+                    continue
+                if self.policy == SKIP:
+                    due = int(np.searchsorted(self.times, now - t0, side='right')) - 1
+                    if due > self.index:
+                        self.skipped += due - self.index
+                        METRICS.overrun('ramp.skip', due - self.index)
+                        self.index = due
+                achieved = time.monotonic() - t0
+                try:
+                    with METRICS.timer('ramp.write'):
+                        self.write(self.index)
+                except Exception as e:
+                    self.error = e
+                    log.error('Ramp stopped, writing point %d of %d failed: %s', self.index + 1, n, e)
+                    break
+                self.planned.append(self.times[self.index])
+                self.achieved.append(achieved)
+                if METRICS.enabled:
+                    METRICS.record('ramp.late', self.achieved[-1] - self.planned[-1])
+                self.index += 1
+        finally:
+            if self.onfinished is not None:
+                self.onfinished(self)
+
+    def write(self, index):
+        self.supply.setCurrent(self.points[index], channel=self.channel, wait=0)
+
+    def report(self):
+        """Achieved vs. planned write times, jitter in seconds"""
+        jitter = np.asarray(self.achieved) - np.asarray(self.planned)
+        result = {'points': len(self.points),
+                  'written': len(self.achieved),
+                  'skipped': self.skipped,
+                  'aborted': self.aborted,
+                  'error': None if self.error is None else str(self.error),
+                  'planned_duration': float(self.holds.sum()),
+                  'achieved_duration': float(self.achieved[-1] + self.holds[-1]) if self.achieved else 0.}
+        if len(jitter):
+            result.update({'jitter_mean': float(jitter.mean()),
+                           'jitter_p50': float(np.percentile(jitter, 50)),
+                           'jitter_p99': float(np.percentile(jitter, 99)),
+                           'jitter_max': float(jitter.max())})
+        return result
+
+
+class CoordinatedRamp(RampExecutor):
+    """Drives several channels from one schedule.
+
+    points has one column per channel. Every point is written as a single
+    setCurrents call, which a Fleet turns into one message per supply sent
+    to all supplies at once, so channels of one supply change together. The
+    skew of a point is the time between the first and the last supply
+    finishing its write.
+    """
+
+    def __init__(self, supply, points, dwell, channels, policy=SKIP, onfinished=None):
+        super().__init__(supply, points, dwell, channel=tuple(channels), policy=policy, onfinished=onfinished)
+        self.skews = []
+
+    def write(self, index):
+        done = self.supply.setCurrents(dict(zip(self.channel, self.points[index])))
+        # a single supply returns nothing, there is no skew between its channels
+        times = list(done.values()) if done else [0.]
+        self.skews.append(max(times) - min(times))
+
+    def report(self):
+        """RampExecutor.report plus the skew between supplies in seconds"""
+        result = super().report()
+        if self.skews:
+            skews = np.asarray(self.skews)
+            result.update({'skew_mean': float(skews.mean()),
+                           'skew_p99': float(np.percentile(skews, 99)),
+                           'skew_max': float(skews.max())})
+        return result
@@ -0,0 +1,130 @@
+# -------------------------------------------------------------------------------
+#  Remote command state - shared by the GUI and the headless service, no Qt
+# -------------------------------------------------------------------------------
+#
+#  Both front ends answer the command set of commands.SPEC from the same
+#  acquisition data. What they share lives here: the sample history and the
+#  newest samples (SampleStore), how a failing poll loop reports and backs
+#  off (PollFailures) and what a subscriber gets sent (drain). The front
+#  ends only differ in how they reach the supplies.
+
+import time
+import numpy as np
+from commands import CommandError, BADARGS, FAILED
+from metrics import METRICS
+from protocol import SampleBlock, samplerows, SAMPLESIZE
+from samplebuffer import LatestSample
+from telemetry import formatsample, addresstext, HIGHWATER
+
+# while the supplies keep failing: seconds between reports of the same failure,
+# and the longest poll interval (s) the polling backs off to
+FAILREPORT = 5.
+BACKOFF = 1.
+
+
+class SampleStore:
+    """The samples remote commands are answered from.
+
+    buffer is the samplebuffer.SampleBuffer of the connected fleet, None
+    before the first connect. It stays after a disconnect, the newest
+    samples in latest do not.
+    """
+
+    def __init__(self, maxage=0.5):
+        self.buffer = None
+        # remote reads older than maxage (s) go to the device instead
+        self.latest = LatestSample(maxage)
+
+    def reset(self, buffer):
+        self.buffer = buffer
+        self.latest.clear()
+
+    def check(self, channel):
+        # the address grammar accepts any supply number, the fleet has only some of them
+        if self.buffer is None:
+            raise CommandError(FAILED, 'not connected')
+        if channel not in self.buffer.channels:
+            raise CommandError(BADARGS, 'no channel {}'.format(addresstext(channel)))
+
+    def append(self, t, values):
+        # values as emitted by the acquisition: {channel: (voltage, current, ...)}
+        self.latest.update(t, values)
+        for channel, v in values.items():
+            self.buffer.append(channel, t, v[0], v[1])
+
+    def cached(self, channel):
+        # (time, voltage, current) if recent enough, else None
+        self.check(channel)
+        return self.latest.get(channel)
+
+    def measured(self, channel, t, values):
+        # a sample the caller has queried itself because the cached one was too old
+        self.latest.update(t, values)
+        return (t,) + tuple(values[channel][:2])
+
+    def samples(self, channel, count):
+        self.check(channel)
+        t, volt, curr = self.buffer.tail(channel, count)
+        return SampleBlock(t, np.full(len(t), channel), volt, curr)
+
+    def history(self, channel, t0, t1, buckets, mode):
+        self.check(channel)
+        t, volt, curr = self.buffer.history(channel, t0, t1, buckets, mode)
+        return SampleBlock(t, np.full(len(t), channel), volt, curr)
+
+
+class PollFailures:
+    """Failed polls in a row.
+
+    The first failure is reported right away, while they go on at most one
+    report every FAILREPORT seconds. The poll interval doubles with every
+    failure up to BACKOFF and is back to normal after the first good poll.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.reported = 0.
+
+    def failed(self, error):
+        # the message to report for this failure, None to stay quiet
+        METRICS.count('acquisition.errors')
+        self.count += 1
+        now = time.monotonic()
+        if self.count == 1:
+            self.reported = now
+            return str(error)
+        if now - self.reported >= FAILREPORT:
+            self.reported = now
+            return '{} ({} failed polls in a row)'.format(error, self.count)
+        return None
+
+    def succeeded(self):
+        # the number of failures this good poll ends, 0 if there were none
+        count, self.count = self.count, 0
+        return count
+
+    def interval(self, interval):
+        # s until the next poll
+        if not self.count:
+            return interval
+        return max(min(interval * 2 ** min(self.count, 10), BACKOFF), interval)
+
+
+def drain(subscription, binary, buffered):
+    """Bytes of queued samples to write to a subscriber, b'' if nothing fits.
+
+    buffered is what the connection has not sent yet. Never more than
+    HIGHWATER is buffered, the rest stays queued (and drops oldest first).
+    """
+    if binary:
+        # everything that fits goes out as one SAMPLES frame
+        if len(subscription) and buffered < HIGHWATER:
+            n = min(len(subscription), (HIGHWATER - buffered) // SAMPLESIZE + 1)
+            return samplerows([subscription.take() for _ in range(n)])
+        return b''
+    out = []
+    while len(subscription) and buffered < HIGHWATER:
+        line = bytes(formatsample(subscription.take()) + '\n', 'utf-8')
+        out.append(line)
+        buffered += len(line)
+    return b''.join(out)
@@ -0,0 +1,187 @@
+# -------------------------------------------------------------------------------
+#  Preallocated sample history for plotting and remote read-out
+# -------------------------------------------------------------------------------
+
+import time
+import numpy as np
+
+
+class RingBuffer:
+    """Fixed-capacity float64 ring buffer.
+
+    Every value is stored twice, at i and i + capacity, so the valid samples
+    are always one contiguous slice of the backing array. view() returns that
+    slice without copying, appending never allocates.
+    """
+
+    def __init__(self, capacity, dtype=np.float64):
+        self.capacity = int(capacity)
+        self.data = np.zeros(2 * self.capacity, dtype=dtype)
+        self.head = 0  # next write position
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, value):
+        self.data[self.head] = value
+        self.data[self.head + self.capacity] = value
+        self.head += 1
+        if self.head == self.capacity:
+            self.head = 0
+        if self.count < self.capacity:
+            self.count += 1
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self.data.dtype)
+        n = len(values)
+        if n >= self.capacity:
+            values = values[-self.capacity:]
+            self.data[:self.capacity] = values
+            self.data[self.capacity:] = values
+            self.head = 0
+            self.count = self.capacity
+            return
+        end = self.head + n
+        if end <= self.capacity:
+            self.data[self.head:end] = values
+            self.data[self.head + self.capacity:end + self.capacity] = values
+        else:
+            split = self.capacity - self.head
+            self.data[self.head:self.capacity] = values[:split]
+            self.data[self.head + self.capacity:] = values[:split]
+            self.data[:n - split] = values[split:]
+            self.data[self.capacity:self.capacity + n - split] = values[split:]
+        self.head = end % self.capacity
+        self.count = min(self.count + n, self.capacity)
+
+    def view(self):
+        # oldest to newest, read-only so callers can not corrupt the mirror
+        start = (self.head - self.count) % self.capacity
+        v = self.data[start:start + self.count]
+        v.flags.writeable = False
+        return v
+
+    def last(self):
+        if self.count == 0:
+            raise IndexError('empty ring buffer')
+        return self.data[self.head - 1 + self.capacity]
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+
+
+class ChannelBuffer:
+    """Time, voltage and current history of one channel.
+
+    Times are seconds since the epoch of the owning SampleBuffer, which keeps
+    full float64 resolution for the plots on long runs.
+    """
+
+    def __init__(self, capacity):
+        self.time = RingBuffer(capacity)
+        self.voltage = RingBuffer(capacity)
+        self.current = RingBuffer(capacity)
+
+    def __len__(self):
+        return len(self.time)
+
+    def append(self, t, volt, curr):
+        self.time.append(t)
+        self.voltage.append(volt)
+        self.current.append(curr)
+
+    def clear(self):
+        self.time.clear()
+        self.voltage.clear()
+        self.current.clear()
+
+
+class SampleBuffer:
+    def __init__(self, capacity, channels=(1, 2, 3), epoch=0.):
+        self.capacity = int(capacity)
+        self.epoch = epoch
+        self.channels = {ch: ChannelBuffer(capacity) for ch in channels}
+
+    def __getitem__(self, channel):
+        return self.channels[channel]
+
+    def append(self, channel, t, volt, curr):
+        # t is an absolute time.time() stamp
+        self.channels[channel].append(t - self.epoch, volt, curr)
+
+    def tail(self, channel, count):
+        # newest count samples as (absolute time, voltage, current) arrays
+        buf = self.channels[channel]
+        count = min(count, len(buf))
+        return (buf.time.view()[len(buf) - count:] + self.epoch,
+                buf.voltage.view()[len(buf) - count:], buf.current.view()[len(buf) - count:])
+
+    def history(self, channel, t0, t1, buckets=0, mode='mean'):
+        # samples with t0 <= time < t1 as (time, voltage, current) arrays, reduced to at
+        # most buckets values per array when buckets > 0. Times are time.time() stamps,
+        # values <= 0 count back from now
+        now = time.time()
+        t0 = t0 + now if t0 <= 0 else t0
+        t1 = t1 + now if t1 <= 0 else t1
+        buf = self.channels[channel]
+        t = buf.time.view()
+        lo, hi = np.searchsorted(t, (t0 - self.epoch, t1 - self.epoch))
+        t, volt, curr = t[lo:hi], buf.voltage.view()[lo:hi], buf.current.view()[lo:hi]
+        if buckets > 0 and len(t) > buckets:
+            t, volt, curr = downsample(t, (volt, curr), t0 - self.epoch, t1 - self.epoch, buckets, mode)
+        return t + self.epoch, volt, curr
+
+    def reset(self, epoch):
+        self.epoch = epoch
+        for buf in self.channels.values():
+            buf.clear()
+
+
+REDUCE = {'min': np.minimum, 'max': np.maximum, 'mean': np.add}
+
+
+def downsample(t, columns, t0, t1, buckets, mode='mean'):
+    """Reduce samples to equal time buckets over [t0, t1).
+
+    Every column is reduced with min, max or mean per bucket, the time of a
+    bucket is the mean time of its samples. Empty buckets are left out.
+    """
+    edges = t0 + (t1 - t0) * np.arange(buckets) / buckets
+    starts = np.unique(np.searchsorted(t, edges))
+    starts = starts[starts < len(t)]
+    counts = np.diff(np.append(starts, len(t)))
+    out = [np.add.reduceat(t, starts) / counts]
+    for c in columns:
+        reduced = REDUCE[mode].reduceat(c, starts)
+        out.append(reduced / counts if mode == 'mean' else reduced)
+    return out
+
+
+class LatestSample:
+    """Newest (time, voltage, current) per channel with an age limit.
+
+    Remote reads are answered from here. get() returns None once the value is
+    older than maxage seconds, the caller then asks the device itself.
+    """
+
+    def __init__(self, maxage=0.5):
+        self.maxage = maxage
+        self.values = {}
+
+    def update(self, t, values):
+        # values as emitted by the acquisition: {channel: (voltage, current, ...)}
+        for channel, v in values.items():
+            self.values[channel] = (t, v[0], v[1])
+
+    def get(self, channel, maxage=None):
+        if maxage is None:
+            maxage = self.maxage
+        sample = self.values.get(channel)
+        if sample is None or time.time() - sample[0] > maxage:
+            return None
+        return sample
+
+    def clear(self):
+        self.values.clear()
@@ -0,0 +1,310 @@
+# -------------------------------------------------------------------------------
+#  Simulated Aim TTi PL-P supply - in-process or as a SCPI server on TCP
+# -------------------------------------------------------------------------------
+#
+#  Resources starting with SIM:: open a simulated supply instead of a VISA
+#  connection, options follow after '?' separated by '&':
+#
+#      SIM::bench?latency=0.002&jitter=0.0005&L=0.5&R=2&faultrate=0.001
+#
+#  The same instrument can be served on a socket for the real driver and
+#  pyvisa-py: python simsupply.py --port 9221 --option L=0.5 ...
+#  and then connected as TCPIP0::127.0.0.1::9221::SOCKET.
+#
+#  The coil on every channel is a series R-L load. The supply regulates the
+#  current towards the setpoint with time constant tau, the rate of change is
+#  limited by the voltage setting (compliance): L dI/dt <= Vset - R I, and an
+#  output that is off lets the current decay with L/R. Measured values carry
+#  gaussian noise and are rounded like the real readback.
+
+import argparse
+import asyncio
+import math
+import random
+import re
+import threading
+import time
+from collections import deque
+from plpbatch import BatchedPLP, SIMPREFIX
+
+IDN = 'THURLBY THANDAR, PL303QMT-P, SIM{:03d}, 3.05-4.06'
+
+# option: default
+OPTIONS = {
+    'latency': 0.001,  # s per round-trip
+    'jitter': 0.0002,  # s, standard deviation added to the latency
+    'cmdtime': 0.0001,  # s per command in a message
+    'R': 1.0,  # Ohm
+    'L': 0.1,  # H
+    'tau': 0.002,  # s, current regulation
+    'vset': 10.0,  # V at power-up
+    'noise': 0.0005,  # standard deviation of measurements (V, A)
+    'faultrate': 0.,  # chance per message of a random fault
+    'timeout': 0.5,  # s until a lost reply is reported
+    'seed': None,
+}
+FAULTS = ('timeout', 'garbage', 'disconnect', 'trip')
+
+COMMAND_RE = re.compile(r'^\s*([A-Z*]+?)(\d?)(O?)(\?)?(?:\s+(\S+))?\s*$')
+
+
+class SimulatedFault(IOError):
+    pass
+
+
+class SimChannel:
+    def __init__(self, options):
+        self.R = options['R']
+        self.L = options['L']
+        self.tau = options['tau']
+        self.vset = options['vset']
+        self.iset = 0.
+        self.deltav = 0.
+        self.deltai = 0.
+        self.on = False
+        self.current = 0.
+        self.voltage = 0.
+        self.t = time.monotonic()
+
+    def advance(self, now):
+        # exact approach to the setpoint per step, limited by the available voltage
+        dt = now - self.t
+        self.t = now
+        if dt <= 0:
+            return
+        steps = max(1, min(1000, int(dt / self.tau)))
+        h = dt / steps
+        target = self.iset if self.on else 0.
+        vmax = self.vset if self.on else 0.
+        rate = 0.
+        for _ in range(steps):
+            i = target + (self.current - target) * math.exp(-h / self.tau)
+            lo = -self.R * self.current / self.L * h
+            hi = (vmax - self.R * self.current) / self.L * h
+            change = min(max(i - self.current, lo), hi)
+            self.current += change
+            rate = change / h
+        self.voltage = min(max(self.R * self.current + self.L * rate, 0.), vmax)
+
+
+class SimInstrument:
+    """Answers PL-P commands, the state of one simulated supply.
+
+    handle() takes a message as sent by the driver (commands separated by
+    ';') and returns the reply line or None if there is nothing to answer.
+    delay() gives the time the message would take on the wire. Faults are
+    either injected one by one with inject() or happen at random with
+    faultrate.
+    """
+
+    def __init__(self, name='', serial=0, **options):
+        self.name = name
+        self.options = dict(OPTIONS)
+        self.options.update(options)
+        self.random = random.Random(self.options['seed'])
+        self.idn = IDN.format(serial)
+        self.channels = {ch: SimChannel(self.options) for ch in (1, 2, 3)}
+        self.faults = deque()
+        self.messages = 0
+        self.lock = threading.Lock()
+
+    def inject(self, fault, count=1):
+        if fault not in FAULTS:
+            raise ValueError('Unknown fault: {}'.format(fault))
+        self.faults.extend([fault] * count)
+
+    def delay(self, commands=1):
+        o = self.options
+        return max(o['latency'] + self.random.gauss(0., o['jitter']), 0.) + commands * o['cmdtime']
+
+    def fault(self):
+        # the fault to apply to the next message, if any
+        if self.faults:
+            return self.faults.popleft()
+        if self.options['faultrate'] and self.random.random() < self.options['faultrate']:
+            return self.random.choice(FAULTS)
+        return None
+
+    def handle(self, message):
+        with self.lock:
+            self.messages += 1
+            now = time.monotonic()
+            for channel in self.channels.values():
+                channel.advance(now)
+            fault = self.fault()
+            if fault == 'trip':
+                self.random.choice(list(self.channels.values())).on = False
+                fault = None
+            replies = [r for r in (self.command(c) for c in message.split(';') if c.strip()) if r is not None]
+            if fault == 'garbage' and replies:
+                return 'ERR'
+            if fault is not None:
+                raise SimulatedFault(fault)
+            return ';'.join(replies) if replies else None
+
+    def command(self, text):
+        match = COMMAND_RE.match(text.upper())
+        if match is None:
+            return None
+        name, ch, measured, query, value = match.groups()
+        channel = self.channels.get(int(ch)) if ch else None
+        noise = self.options['noise']
+        if name == '*IDN' and query:
+            return self.idn
+        if name in ('V', 'I') and channel is not None:
+            if query and measured:
+                v = channel.voltage if name == 'V' else channel.current
+                v += self.random.gauss(0., noise)
+                return '{:.3f}{}'.format(max(v, 0.), 'V' if name == 'V' else 'A')
+            if query:
+                return '{}{} {:.3f}'.format(name, ch, channel.vset if name == 'V' else channel.iset)
+            if value is not None:
+                if name == 'V':
+                    channel.vset = float(value)
+                else:
+                    channel.iset = float(value)
+            return None
+        if name == 'OP' and channel is not None:
+            if query:
+                return '1' if channel.on else '0'
+            if value is not None:
+                channel.on = value == '1'
+            return None
+        if name == 'OPALL' and value is not None:
+            for c in self.channels.values():
+                c.on = value == '1'
+            return None
+        if name in ('DELTAV', 'DELTAI') and channel is not None and value is not None:
+            setattr(channel, name.lower(), float(value))
+            return None
+        if name in ('INCV', 'DECV', 'INCI', 'DECI') and channel is not None:
+            step = (channel.deltav if name[3] == 'V' else channel.deltai) * (1 if name[:3] == 'INC' else -1)
+            if name[3] == 'V':
+                channel.vset = max(channel.vset + step, 0.)
+            else:
+                channel.iset = max(channel.iset + step, 0.)
+            return None
+        # LOCAL, IFLOCK, *WAI, *RST, *CLS and anything unknown are accepted silently
+        return None
+
+
+class SimResource:
+    """The part of a pyvisa resource the driver uses, talking to a SimInstrument."""
+
+    def __init__(self, instrument):
+        self.instrument = instrument
+        self.pending = deque()
+        self.closed = False
+
+    def send(self, message):
+        if self.closed:
+            raise SimulatedFault('disconnected')
+        time.sleep(self.instrument.delay(message.count(';') + 1))
+        try:
+            reply = self.instrument.handle(message)
+        except SimulatedFault as e:
+            if str(e) == 'disconnect':
+                self.closed = True
+            elif str(e) == 'timeout':
+                time.sleep(self.instrument.options['timeout'])
+            raise
+        if reply is not None:
+            self.pending.append(reply)
+
+    def write(self, message):
+        self.send(message)
+        return len(message)
+
+    def read(self):
+        if not self.pending:
+            time.sleep(self.instrument.options['timeout'])
+            raise SimulatedFault('timeout')
+        return self.pending.popleft()
+
+    def query(self, message, delay=None):
+        self.pending.clear()
+        self.send(message)
+        return self.read()
+
+    def close(self):
+        self.closed = True
+
+
+class SimulatedPLP(BatchedPLP):
+    """BatchedPLP on a simulated instrument, all driver code runs unchanged."""
+
+    instruments = {}
+
+    def __init__(self, resource, **kwargs):
+        super().__init__(resource, **kwargs)
+        name, options = parseresource(resource)
+        # one instrument per name, reconnecting finds the coil in the state it was left in
+        if name not in self.instruments:
+            self.instruments[name] = SimInstrument(name, len(self.instruments), **options)
+        self.instrument = self.instruments[name]
+
+    def open(self):
+        self._inst = SimResource(self.instrument)
+
+    def close(self):
+        self._inst.close()
+
+
+def parseresource(resource):
+    # 'SIM::name?key=value&key=value' -> (name, {key: value})
+    name, _, query = resource[len(SIMPREFIX):].partition('?')
+    options = {}
+    for item in filter(None, query.split('&')):
+        key, _, value = item.partition('=')
+        if key not in OPTIONS:
+            raise ValueError('Unknown simulator option: {}'.format(key))
+        options[key] = int(value) if key == 'seed' else float(value)
+    return name, options
+
+
+async def serve(instrument, host='127.0.0.1', port=9221):
+    """SCPI server for the real driver: CR/LF terminated messages, one reply line per query message"""
+
+    async def client(reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = line.decode('ascii', errors='replace').strip()
+                if not message:
+                    continue
+                await asyncio.sleep(instrument.delay(message.count(';') + 1))
+                try:
+                    reply = instrument.handle(message)
+                except SimulatedFault as e:
+                    if str(e) == 'disconnect':
+                        break
+                    continue  # lost reply
+                if reply is not None:
+                    writer.write(bytes(reply + '\n', 'ascii'))
+                    await writer.drain()
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(client, host, port)
+    print('Simulated {} on {}:{}'.format(instrument.idn, host, port))
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulated Aim TTi PL-P on a socket')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9221)
+    parser.add_argument('--option', action='append', default=[], help='key=value, see OPTIONS')
+    args = parser.parse_args()
+    _, options = parseresource(SIMPREFIX + 'tcp?' + '&'.join(args.option))
+    try:
+        asyncio.run(serve(SimInstrument('tcp', **options), args.host, args.port))
+    except KeyboardInterrupt:
+        print('Simulator stopped')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+# -------------------------------------------------------------------------------
+#  Startup phases of the GUI - imported first, so the clock starts with the imports
+# -------------------------------------------------------------------------------
+
+import time
+
+STARTED = time.perf_counter()
+phases = []
+
+
+def phase(name):
+    # name ends the phase that began with the previous one
+    phases.append((name, time.perf_counter()))
+
+
+def report():
+    """'imports 120 ms, window 40 ms, ..., total 180 ms', each phase also goes to the metrics"""
+    from metrics import METRICS
+    parts = []
+    last = STARTED
+    for name, t in phases:
+        METRICS.record('startup.' + name, t - last)
+        parts.append('{} {:.0f} ms'.format(name, (t - last) * 1000))
+        last = t
+    parts.append('total {:.0f} ms'.format((last - STARTED) * 1000))
+    return ', '.join(parts)
@@ -0,0 +1,89 @@
+# -------------------------------------------------------------------------------
+#  Telemetry subscriptions - decimated sample streams for remote clients
+# -------------------------------------------------------------------------------
+
+from collections import deque
+from metrics import METRICS
+from logconfig import getlogger
+
+log = getlogger('telemetry')
+
+# samples kept per subscriber while its socket is busy, older ones are dropped
+BACKLOG = 1000
+# bytes a client may have in flight before its sample stream is held back
+HIGHWATER = 64 * 1024
+# channel ids of a fleet: SPACING * supply index + channel, so the first supply keeps 1, 2, 3
+SPACING = 10
+
+
+class Subscription:
+    """Push stream of samples for one client.
+
+    offer() is called with every acquired sample and keeps at most rate
+    samples per second of the subscribed channels. Lines wait in a bounded
+    queue until the server can write them; when a slow client lets the
+    queue fill up, the oldest lines are dropped and counted, in dropped and
+    as overruns of telemetry.dropped. The first drop of a stream is logged.
+    """
+
+    def __init__(self, channels, rate, backlog=BACKLOG):
+        self.channels = tuple(channels)
+        self.interval = 1. / rate
+        self.next = 0.
+        self.queue = deque(maxlen=backlog)
+        self.dropped = 0
+
+    def offer(self, t, values):
+        if t < self.next:
+            return
+        self.next = self.next + self.interval if self.next + self.interval > t else t + self.interval
+        for ch in self.channels:
+            if ch in values:
+                if len(self.queue) == self.queue.maxlen:
+                    if not self.dropped:
+                        log.warning('Subscriber too slow, dropping its oldest samples')
+                    self.dropped += 1
+                    METRICS.overrun('telemetry.dropped')
+                self.queue.append((t, ch) + tuple(values[ch][:2]))
+
+    def take(self):
+        return self.queue.popleft()
+
+    def __len__(self):
+        return len(self.queue)
+
+
+def formatsample(sample):
+    # sample:<time.time()>,<channel>,<voltage>,<current>
+    t, channel, volt, curr = sample
+    return 'sample:{:.6f},{},{},{}'.format(t, addresstext(channel), volt, curr)
+
+
+def address(text):
+    # channel id of '<channel>' on the first supply or '<supply>:<channel>', supplies count from 1
+    supply, _, channel = text.strip().rpartition(':')
+    supply = int(supply) if supply else 1
+    channel = int(channel)
+    if supply < 1 or channel not in (1, 2, 3):
+        raise ValueError(text)
+    return SPACING * (supply - 1) + channel
+
+
+def addresstext(channel):
+    channel = int(channel)
+    if channel < SPACING:
+        return str(channel)
+    return '{}:{}'.format(channel // SPACING + 1, channel % SPACING)
+
+
+def channellist(text):
+    # '1', '1+3', '1+2:1+2:2', every channel once
+    channels = tuple(address(c) for c in text.split('+'))
+    if len(set(channels)) != len(channels):
+        raise ValueError(text)
+    return channels
+
+
+def floatlist(text):
+    # '1.0+0.5', one value per entry of a channellist
+    return tuple(float(v) for v in text.split('+'))
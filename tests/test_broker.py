@@ -0,0 +1,135 @@
+import threading
+import pytest
+from broker import DeviceBroker, BrokerStopped, PRIORITY_RAMP, PRIORITY_CONTROL, PRIORITY_MONITOR
+
+
+class Supply:
+    """Records calls, block() holds the broker thread until release is set"""
+
+    def __init__(self):
+        self.calls = []
+        self.channel = 1
+        self.current = 0.
+        self.blocked = threading.Event()
+        self.release = threading.Event()
+
+    def block(self):
+        self.blocked.set()
+        self.release.wait(5.)
+
+    def setCurrent(self, current, channel=None, wait=None):
+        self.calls.append(('setCurrent', current))
+        self.current = current
+
+    def incCurrentByDelta(self, channel=None):
+        self.calls.append(('incCurrentByDelta', channel))
+        self.current += 0.1
+
+    def queryCurrent(self, channel=None):
+        self.calls.append(('queryCurrent', channel))
+        return self.current
+
+    def measureCurrent(self, channel=None):
+        self.calls.append(('measureCurrent', channel))
+        return self.current
+
+
+@pytest.fixture
+def broker():
+    broker = DeviceBroker(Supply())
+    broker.start()
+    yield broker
+    broker.supply.release.set()
+    broker.stop()
+
+
+def hold(broker):
+    # the broker thread is busy until broker.supply.release is set
+    future = broker.submit('block')
+    assert broker.supply.blocked.wait(5.)
+    return future
+
+
+def test_priority_order(broker):
+    hold(broker)
+    futures = [broker.submit('measureCurrent', 1, priority=PRIORITY_MONITOR),
+               broker.submit('setCurrent', 0.2, priority=PRIORITY_CONTROL),
+               broker.submit('setCurrent', 0.1, priority=PRIORITY_RAMP),
+               broker.submit('setCurrent', 0.3, priority=PRIORITY_CONTROL)]
+    broker.supply.release.set()
+    for f in futures:
+        f.result(5.)
+    assert broker.supply.calls == [('setCurrent', 0.1), ('setCurrent', 0.2), ('setCurrent', 0.3),
+                                   ('measureCurrent', 1)]
+
+
+def test_identical_reads_are_coalesced(broker):
+    hold(broker)
+    first = broker.submit('measureCurrent', 2, priority=PRIORITY_MONITOR)
+    second = broker.submit('measureCurrent', 2, priority=PRIORITY_MONITOR)
+    other = broker.submit('measureCurrent', 3, priority=PRIORITY_MONITOR)
+    assert first is second and first is not other
+    broker.supply.release.set()
+    assert first.result(5.) == other.result(5.) == 0.
+    assert broker.supply.calls == [('measureCurrent', 2), ('measureCurrent', 3)]
+
+
+def test_coalesced_read_moves_forward(broker):
+    hold(broker)
+    read = broker.submit('queryCurrent', 1, priority=PRIORITY_MONITOR)
+    write = broker.submit('setCurrent', 0.5, priority=PRIORITY_CONTROL)
+    assert broker.submit('queryCurrent', 1, priority=PRIORITY_RAMP) is read
+    broker.supply.release.set()
+    write.result(5.)
+    # answered before the write, once
+    assert read.result(5.) == 0.
+    assert broker.supply.calls == [('queryCurrent', 1), ('setCurrent', 0.5)]
+
+
+def test_writes_are_not_coalesced(broker):
+    hold(broker)
+    futures = [broker.submit('setCurrent', 0.5) for _ in range(2)]
+    assert futures[0] is not futures[1]
+    broker.supply.release.set()
+    for f in futures:
+        f.result(5.)
+    assert broker.supply.calls == [('setCurrent', 0.5)] * 2
+
+
+def test_stop_cancels_queued_requests(broker):
+    running = hold(broker)
+    queued = [broker.submit('setCurrent', 0.5), broker.submit('measureCurrent', 1, priority=PRIORITY_MONITOR)]
+    stopper = threading.Thread(target=broker.stop)
+    stopper.start()
+    broker.supply.release.set()
+    stopper.join(5.)
+    # the request in progress finishes
+    assert running.result(5.) is None
+    for f in queued:
+        with pytest.raises(BrokerStopped):
+            f.result(5.)
+    assert broker.supply.calls == []
+    with pytest.raises(BrokerStopped):
+        broker.submit('measureCurrent', 1)
+
+
+def test_call_from_the_broker_thread(broker):
+    # a request may call the broker again without waiting for itself
+    broker.supply.nested = lambda: broker.call('queryCurrent', 1)
+    assert broker.call('nested') == 0.
+
+
+class Log:
+    def __init__(self):
+        self.setpoints = []
+
+    def setpoint(self, t, channel, **values):
+        self.setpoints.append((channel, values))
+
+
+def test_setpoints_are_logged(broker):
+    broker.log = Log()
+    broker.base = 10
+    broker.call('setCurrent', 0.5, channel=2)
+    broker.call('incCurrentByDelta', channel=3)
+    assert broker.log.setpoints == [(12, {'current': 0.5}), (13, {'current': 0.6})]
@@ -0,0 +1,64 @@
+from commands import CommandRegistry, Arg, SPEC, UNKNOWN, BADARGS, FAILED
+
+
+def registry(calls):
+    commands = CommandRegistry()
+    commands.bind({name: (lambda *args, name=name: calls.append((name, args)) or 'Done!') for name, _, _ in SPEC})
+    return commands
+
+
+def test_dispatch():
+    calls = []
+    commands = registry(calls)
+    assert commands.dispatch('set_current:2:1,0.5') == 'Done!'
+    assert commands.dispatch('subscribe', client=7) == 'Done!'
+    assert calls == [('set_current', (11, 0.5)), ('subscribe', (7, (1, 2, 3), 10.))]
+
+
+def test_errors():
+    commands = registry([])
+    assert commands.dispatch('nothing:1') == UNKNOWN
+    assert commands.dispatch('set current') == UNKNOWN
+    assert commands.dispatch('set_current:1').startswith(BADARGS)
+    assert commands.dispatch('set_current:4,1').startswith(BADARGS)
+    assert commands.dispatch('set_current:1,one').startswith(BADARGS)
+    assert commands.dispatch('set_current:1,-1').startswith(BADARGS)
+    assert commands.dispatch('set_output:1,2').startswith(BADARGS)
+
+
+def test_nonfinite():
+    calls = []
+    commands = registry(calls)
+    for line in ('set_smoothtarget:nan', 'set_smoothrate:NaN', 'set_current:1,nan', 'set_current:1,inf',
+                 'subscribe:1,nan', 'get_history:1,-inf,0'):
+        assert commands.dispatch(line, client=1).startswith(BADARGS), line
+    assert calls == []
+
+
+def test_handler_failure():
+    commands = CommandRegistry()
+    commands.bind({'get_volt': lambda channel: 1 / 0})
+    assert commands.dispatch('get_volt:1').startswith(FAILED)
+
+
+def test_arg_limits():
+    arg = Arg('dwell', int, min=1, max=1000)
+    assert arg.convert(' 10 ') == 10
+    for text in ('0', '1001', '1.5'):
+        try:
+            arg.convert(text)
+        except Exception as e:
+            assert e.tag == BADARGS
+        else:
+            raise AssertionError(text)
+
+
+def test_coordinatedramp_arguments():
+    calls = []
+    commands = registry(calls)
+    assert commands.dispatch('start_coordinatedramp:1+2:1,1+0.5') == 'Done!'
+    assert calls == [('start_coordinatedramp', ((1, 11), (1., 0.5)))]
+    for line in ('start_coordinatedramp:1,-1', 'start_coordinatedramp:1,50', 'start_coordinatedramp:1+2,1+nan',
+                 'start_coordinatedramp:1+1,1+2'):
+        assert commands.dispatch(line).startswith(BADARGS), line
+    assert len(calls) == 1
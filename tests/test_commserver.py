@@ -0,0 +1,19 @@
+from commserver import ClientConnection
+from protocol import MAXLINE
+
+
+def test_feed_lines():
+    connection = ClientConnection(1, None)
+    assert connection.feed(b'get_volt:1\r\nget_c') == [b'get_volt:1']
+    assert connection.feed(b'urr:1\n') == [b'get_curr:1']
+
+
+def test_feed_long_line_in_one_segment():
+    connection = ClientConnection(1, None)
+    assert connection.feed(b'x' * 5000 + b'\nget_volt:1\n') == [None, b'get_volt:1']
+
+
+def test_feed_long_line_split():
+    connection = ClientConnection(1, None)
+    assert connection.feed(b'x' * (MAXLINE + 1)) == [None]
+    assert connection.feed(b'xxx\nget_volt:1\n') == [b'get_volt:1']
@@ -0,0 +1,46 @@
+import os
+import numpy as np
+from datalog import DataLog, LogReader, readlog, HEADER, RECORD, SAMPLE, SETCURRENT, SETVOLTAGE, UNKNOWN
+
+
+def test_write_and_read_back(tmp_path):
+    log = DataLog(str(tmp_path), fsync=0.05)
+    log.start()
+    log.samples(100., {1: (1., 0.5, True), 11: (2., 1.5)})
+    log.setpoint(100.5, 1, current=0.75)
+    log.setpoint(101., 11, voltage=12.)
+    log.samples(102., {1: (1.1, 0.6, False)})
+    log.stop()
+    reader = LogReader(str(tmp_path))
+    t, volt, curr, output = reader.samples(1)
+    assert list(t) == [100., 102.] and list(volt) == [1., 1.1] and list(output) == [1, 0]
+    t, volt, curr, output = reader.samples(11)
+    assert list(curr) == [1.5] and list(output) == [UNKNOWN]
+    assert [list(a) for a in reader.setpoints(1)] == [[100.5], [0.75]]
+    assert [list(a) for a in reader.setpoints(11, SETVOLTAGE)] == [[101.], [12.]]
+    r = reader.records(100.2, 101.5)
+    assert list(r['kind']) == [SETCURRENT, SETVOLTAGE] and np.isnan(r['voltage'][0])
+
+
+def test_rotation_and_time_range(tmp_path):
+    # every write starts a new file, all within the same second
+    log = DataLog(str(tmp_path), maxbytes=1)
+    for i in range(3):
+        log.write(np.array([(float(i), i, i, SAMPLE, 1, UNKNOWN)], dtype=RECORD))
+    log.close()
+    reader = LogReader(str(tmp_path))
+    assert len(reader.logs) == 3
+    assert list(reader.samples(1)[0]) == [0., 1., 2.]
+    assert list(reader.samples(1, 0.5, 2.)[0]) == [1.]
+
+
+def test_truncated_file_is_readable(tmp_path):
+    log = DataLog(str(tmp_path))
+    log.start()
+    log.samples(1., {1: (1., 2.), 2: (3., 4.)})
+    log.stop()
+    with open(log.path, 'ab') as f:
+        f.write(b'\0' * 7)
+    records = readlog(log.path)
+    assert len(records) == 2 and list(records['kind']) == [SAMPLE, SAMPLE]
+    assert os.path.getsize(log.path) == HEADER.size + 2 * RECORD.itemsize + 7
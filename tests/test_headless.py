@@ -0,0 +1,33 @@
+import asyncio
+from headless import ControlService
+from protocol import TOOLONG
+
+
+async def exchange(service, *segments):
+    # send the segments one by one, return the reply lines
+    server = await asyncio.start_server(service.handle, '127.0.0.1', 0)
+    reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+    for segment in segments:
+        writer.write(segment)
+        await writer.drain()
+        await asyncio.sleep(0.05)
+    writer.write_eof()
+    replies = (await reader.read()).decode().splitlines()
+    writer.close()
+    server.close()
+    await server.wait_closed()
+    return replies
+
+
+def test_overlong_line_split_over_segments():
+    service = ControlService('SIM::test', logdir='')
+    replies = asyncio.run(exchange(service, b'x' * 5000, b'x' * 100 + b'set_smoothdwell:5\n',
+                                   b'set_smoothdwell:7\n'))
+    assert replies == [TOOLONG, 'Done!']
+    assert service.smoothdwell == 7
+
+
+def test_overlong_line_in_one_segment():
+    service = ControlService('SIM::test', logdir='')
+    replies = asyncio.run(exchange(service, b'x' * 5000 + b'\nset_smoothdwell:5\nset_smoothrate:2\n'))
+    assert replies == [TOOLONG, 'Done!', 'Done!']
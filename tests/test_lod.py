@@ -0,0 +1,63 @@
+import numpy as np
+from samplebuffer import RingBuffer
+from lod import MinMaxPyramid, FACTOR
+
+
+def pyramid(values, capacity=None):
+    capacity = capacity or len(values)
+    time, data = RingBuffer(capacity), RingBuffer(capacity)
+    lod = MinMaxPyramid(time, data)
+    for t, v in enumerate(values):
+        time.append(t)
+        data.append(v)
+        lod.append(t, v)
+    return lod
+
+
+def test_few_samples_are_returned_raw():
+    values = np.sin(np.arange(500.))
+    t, v = pyramid(values).select(pixels=1000)
+    assert list(v) == list(values) and list(t) == list(range(500))
+
+
+def test_select_range_is_raw_when_it_fits():
+    lod = pyramid(np.arange(100000.))
+    t, v = lod.select(1000., 1100., pixels=100)
+    # one sample beyond each edge
+    assert t[0] == 999. and t[-1] == 1100. and list(v) == list(t)
+
+
+def test_envelope_keeps_spikes_and_bounds_points():
+    values = np.zeros(100000)
+    values[54321] = 10.
+    values[12345] = -5.
+    t, v = pyramid(values).select(pixels=500)
+    assert len(t) <= 4 * 500 and len(t) == len(v)
+    assert v.max() == 10. and v.min() == -5.
+    # the zigzag runs through the min and max of every block
+    assert np.all(t[::2] == t[1::2])
+
+
+def test_envelope_matches_blocks():
+    values = np.random.RandomState(1).normal(size=FACTOR ** 6)
+    lod = pyramid(values)
+    t, v = lod.select(pixels=FACTOR ** 6 // FACTOR // 2 - 1)
+    size = FACTOR ** 2
+    blocks = values.reshape(-1, size)
+    assert list(t[::2]) == list(np.arange(0, len(values), size))
+    assert np.array_equal(v[::2], blocks.min(axis=1)) and np.array_equal(v[1::2], blocks.max(axis=1))
+
+
+def test_newest_partial_block_is_included():
+    values = np.arange(FACTOR ** 6 + 3.)
+    t, v = pyramid(values, capacity=FACTOR ** 7).select(pixels=100)
+    assert v.max() == values[-1]
+
+
+def test_clear():
+    lod = pyramid(np.arange(10000.))
+    lod.time.clear()
+    lod.values.clear()
+    lod.clear()
+    t, v = lod.select()
+    assert len(t) == 0
@@ -0,0 +1,49 @@
+import numpy as np
+import protocol
+from protocol import LineBuffer, MAXLINE, SampleBlock
+
+
+def test_text_frame_round_trip():
+    frame = protocol.encode('Done! ON', True)
+    kind, payload, rest = protocol.readframe(frame + b'more')
+    assert kind == protocol.TEXT and payload == b'Done! ON' and rest == b'more'
+    assert protocol.encode('Done!', False) == b'Done!\n'
+
+
+def test_partial_frame():
+    frame = protocol.textframe('0.5')
+    for n in range(len(frame)):
+        assert protocol.readframe(frame[:n]) is None
+
+
+def test_sample_frame_round_trip():
+    block = SampleBlock(np.array([1.5, 2.5]), np.array([1, 11]), np.array([0.1, 0.2]), np.array([1., 2.]))
+    kind, payload, rest = protocol.readframe(protocol.encode(block, True))
+    assert kind == protocol.SAMPLES and rest == b''
+    assert len(payload) == protocol.COUNT.size + 2 * protocol.SAMPLESIZE
+    t, channel, volt, curr = protocol.unpacksamples(payload)
+    assert list(t) == [1.5, 2.5] and list(channel) == [1, 11]
+    assert list(volt) == [0.1, 0.2] and list(curr) == [1., 2.]
+
+
+def test_sample_rows():
+    kind, payload, _ = protocol.readframe(protocol.samplerows([(1., 2, 0.5, 0.25), (2., 3, 0.75, 0.5)]))
+    t, channel, volt, curr = protocol.unpacksamples(payload)
+    assert list(channel) == [2, 3] and list(curr) == [0.25, 0.5]
+
+
+def test_sample_block_text():
+    block = SampleBlock([1.5], [12], [0.1], [1.])
+    assert protocol.encode(block, False) == b'1.500000,2:2,0.1,1.0\n'
+    assert protocol.encode(SampleBlock([], [], [], []), False) == b'\n'
+
+
+def test_line_buffer():
+    lines = LineBuffer()
+    assert lines.feed(b'a\r\nb') == [b'a']
+    assert lines.feed(b'c\n\n') == [b'bc', b'']
+    assert lines.feed(b'x' * MAXLINE + b'\n') == [b'x' * MAXLINE]
+    assert lines.feed(b'x' * (MAXLINE + 1) + b'\nd\n') == [None, b'd']
+    assert lines.feed(b'x' * (MAXLINE + 1)) == [None]
+    assert lines.feed(b'x' * 10) == []
+    assert lines.feed(b'x\ne\n') == [b'e']
@@ -0,0 +1,48 @@
+import numpy as np
+from ramp import RampExecutor, CoordinatedRamp
+
+
+class Supply:
+    def __init__(self, failat=None):
+        self.written = []
+        self.failat = failat
+
+    def setCurrent(self, current, channel=None, wait=None):
+        if len(self.written) == self.failat:
+            raise IOError('supply gone')
+        self.written.append((channel, current))
+
+    def setCurrents(self, currents):
+        self.setCurrent(currents)
+
+
+def run(ramp):
+    finished = []
+    ramp.onfinished = finished.append
+    ramp.start()
+    ramp.wait(5.)
+    assert finished == [ramp]
+    return ramp.report()
+
+
+def test_ramp_writes_all_points():
+    supply = Supply()
+    report = run(RampExecutor(supply, np.linspace(0., 1., 10), 0.001, channel=2, policy='catchup'))
+    assert supply.written == [(2, v) for v in np.linspace(0., 1., 10)]
+    assert report['written'] == 10
+    assert report['error'] is None and not report['aborted']
+
+
+def test_ramp_write_failure():
+    supply = Supply(failat=2)
+    ramp = RampExecutor(supply, np.linspace(0., 1., 10), 0.001, policy='catchup')
+    report = run(ramp)
+    assert report['written'] == 2
+    assert report['error'] == 'supply gone'
+    assert not report['aborted']
+
+
+def test_coordinated_ramp_write_failure():
+    supply = Supply(failat=1)
+    report = run(CoordinatedRamp(supply, np.zeros((5, 2)), 0.001, (1, 11)))
+    assert report['written'] == 1 and report['error'] == 'supply gone'
@@ -0,0 +1,78 @@
+import time
+import pytest
+import protocol
+from commands import CommandError, BADARGS, FAILED
+from remote import SampleStore, PollFailures, drain, BACKOFF
+from samplebuffer import SampleBuffer
+from telemetry import Subscription, HIGHWATER
+
+
+def test_store_checks_channels():
+    store = SampleStore()
+    with pytest.raises(CommandError) as e:
+        store.samples(1, 10)
+    assert e.value.tag == FAILED
+    store.reset(SampleBuffer(100, (1, 2, 3, 11, 12, 13), 0.))
+    with pytest.raises(CommandError) as e:
+        store.cached(21)
+    assert e.value.reply() == BADARGS + ' no channel 3:1'
+
+
+def test_store_samples_and_cache():
+    store = SampleStore(maxage=10.)
+    store.reset(SampleBuffer(100, (1, 2), 0.))
+    t = time.time()
+    store.append(t, {1: (1., 0.5), 2: (2., 1.)})
+    store.append(t + 0.01, {1: (1.5, 0.75), 2: (2., 1.)})
+    block = store.samples(1, 10)
+    assert list(block.volt) == [1., 1.5] and list(block.channel) == [1, 1]
+    assert store.cached(1) == (t + 0.01, 1.5, 0.75)
+    store.latest.clear()
+    assert store.cached(1) is None
+    assert store.measured(2, t, {2: (3., 1.5, True)}) == (t, 3., 1.5)
+
+
+def test_poll_failures():
+    failures = PollFailures()
+    assert failures.interval(0.01) == 0.01
+    assert failures.failed(IOError('gone')) == 'gone'
+    assert failures.failed(IOError('gone')) is None
+    assert failures.interval(0.01) == 0.04
+    for _ in range(20):
+        failures.failed(IOError('gone'))
+    assert failures.interval(0.01) == BACKOFF
+    assert failures.interval(2.) == 2.
+    failures.reported -= 10.
+    assert failures.failed(IOError('gone')) == 'gone (23 failed polls in a row)'
+    assert failures.succeeded() == 23
+    assert failures.succeeded() == 0
+    assert failures.interval(0.01) == 0.01
+
+
+def test_drain():
+    subscription = Subscription((1,), 1000.)
+    for i in range(3):
+        subscription.offer(i, {1: (1., 2.)})
+    text = drain(subscription, False, 0)
+    assert text.decode().splitlines() == ['sample:{:.6f},1,1.0,2.0'.format(i) for i in range(3)]
+    assert drain(subscription, False, 0) == b''
+    subscription.offer(5, {1: (1., 2.)})
+    assert drain(subscription, True, HIGHWATER) == b''
+    kind, payload, rest = protocol.readframe(drain(subscription, True, 0))
+    assert kind == protocol.SAMPLES and rest == b''
+    assert list(protocol.unpacksamples(payload)[0]) == [5.]
+
+
+def test_dropped_samples_are_reported():
+    from metrics import METRICS
+    subscription = Subscription((1, 2), 1000., backlog=3)
+    enabled, METRICS.enabled = METRICS.enabled, True
+    METRICS.reset()
+    try:
+        subscription.offer(0., {1: (1., 2.), 2: (1., 2.)})
+        subscription.offer(1., {1: (1., 2.), 2: (1., 2.)})
+        assert subscription.dropped == 1
+        assert METRICS.snapshot()['overruns']['telemetry.dropped'] == 1
+    finally:
+        METRICS.enabled = enabled
+        METRICS.reset()
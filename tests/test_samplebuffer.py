@@ -0,0 +1,83 @@
+import time
+import numpy as np
+from samplebuffer import RingBuffer, SampleBuffer, LatestSample, downsample
+
+
+def test_ring_append_wraps():
+    ring = RingBuffer(4)
+    for v in range(6):
+        ring.append(v)
+    assert list(ring.view()) == [2, 3, 4, 5]
+    assert ring.last() == 5 and len(ring) == 4
+
+
+def test_ring_extend_wraps():
+    ring = RingBuffer(5)
+    ring.extend([0, 1, 2])
+    ring.extend([3, 4, 5, 6])
+    assert list(ring.view()) == [2, 3, 4, 5, 6]
+    ring.extend([7])
+    assert list(ring.view()) == [3, 4, 5, 6, 7]
+    # more than fits keeps the newest
+    ring.extend(np.arange(10, 22))
+    assert list(ring.view()) == [17, 18, 19, 20, 21]
+    ring.append(22)
+    assert list(ring.view()) == [18, 19, 20, 21, 22]
+
+
+def test_ring_extend_matches_append():
+    a, b = RingBuffer(7), RingBuffer(7)
+    values = np.arange(40.)
+    for chunk in np.split(values, [3, 4, 11, 12, 20, 33]):
+        a.extend(chunk)
+        for v in chunk:
+            b.append(v)
+        assert list(a.view()) == list(b.view())
+
+
+def test_ring_view_is_read_only():
+    ring = RingBuffer(3)
+    ring.extend([1, 2])
+    view = ring.view()
+    try:
+        view[0] = 5
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('view is writeable')
+
+
+def test_sample_buffer_tail_and_history():
+    epoch = 1000.
+    buffer = SampleBuffer(100, (1, 11), epoch)
+    for i in range(10):
+        buffer.append(11, epoch + i, i, 2 * i)
+    t, volt, curr = buffer.tail(11, 3)
+    assert list(t) == [1007., 1008., 1009.] and list(curr) == [14, 16, 18]
+    t, volt, curr = buffer.history(11, 1002., 1006.)
+    assert list(volt) == [2, 3, 4, 5]
+    t, volt, curr = buffer.history(11, 1000., 1010., buckets=2, mode='max')
+    assert list(volt) == [4, 9] and list(t) == [1002., 1007.]
+    assert len(buffer.tail(1, 5)[0]) == 0
+
+
+def test_downsample_modes():
+    t = np.arange(8.)
+    values = np.array([1., 5., 2., 2., 7., 0., 3., 3.])
+    assert list(downsample(t, (values,), 0., 8., 2, 'min')[1]) == [1., 0.]
+    assert list(downsample(t, (values,), 0., 8., 2, 'max')[1]) == [5., 7.]
+    assert list(downsample(t, (values,), 0., 8., 2, 'mean')[1]) == [2.5, 3.25]
+    # empty buckets are left out
+    assert len(downsample(t, (values,), 0., 16., 4, 'mean')[0]) == 2
+
+
+def test_latest_sample_ages_out():
+    latest = LatestSample(maxage=0.5)
+    now = time.time()
+    latest.update(now, {1: (1., 2., True)})
+    latest.update(now - 1., {2: (3., 4.)})
+    assert latest.get(1) == (now, 1., 2.)
+    assert latest.get(2) is None
+    assert latest.get(2, maxage=2.) == (now - 1., 3., 4.)
+    latest.clear()
+    assert latest.get(1) is None
@@ -0,0 +1,37 @@
+import numpy as np
+import trajectory
+
+
+def test_compress_empty():
+    points, holds = trajectory.compress(np.zeros(0), 0.1)
+    assert len(points) == 0 and len(holds) == 0
+
+
+def test_compress_single_point():
+    points, holds = trajectory.compress(np.array([0.1]), 0.1)
+    assert points.tolist() == [0.1]
+    assert holds.tolist() == [0.1]
+    points, holds = trajectory.compress(np.array([0.1]), 0.1, tolerance=0.01)
+    assert points.tolist() == [0.1]
+    assert holds.tolist() == [0.1]
+
+
+def test_compress_single_row_2d():
+    points, holds = trajectory.compress(np.array([[0.1, 0.2]]), 0.1)
+    assert points.tolist() == [[0.1, 0.2]]
+    assert holds.tolist() == [0.1]
+
+
+def test_compress_2d():
+    points = np.array([[0., 0.], [0., 0.], [0., 1.], [1., 1.], [1., 1.]])
+    kept, holds = trajectory.compress(points, 0.1)
+    assert kept.tolist() == [[0., 0.], [0., 1.], [1., 1.]]
+    assert np.allclose(holds, [0.2, 0.1, 0.2])
+
+
+def test_one_point_trajectory_compresses():
+    # 0.1 A at 1 A/s with 100 ms dwell gives a single point
+    dwell, points, _ = trajectory.trajectory(0., 0.1, 1., 0.1)
+    assert len(points) == 1
+    kept, holds = trajectory.compress(points, dwell)
+    assert len(kept) == 1 and holds.tolist() == [dwell]
@@ -0,0 +1,135 @@
+# -------------------------------------------------------------------------------
+#  Current trajectories for ramps - pure functions, no device or GUI access
+# -------------------------------------------------------------------------------
+
+from functools import lru_cache
+import numpy as np
+
+# setpoint resolution of the supply (A)
+DECIMALS = 3
+
+
+# Shapes map a time array x in [0, x3] to a current offset in [0, y3]
+def linear(x, x3, y3):
+    return x * (y3 / x3)
+
+
+def smooth(x, x3, y3):
+    # quadratic - linear - quadratic, one third of the ramp time each
+    return np.piecewise(x, [x < x3 / 3, (x3 / 3 <= x) * (x < 2 * x3 / 3), (2 * x3 / 3 <= x) * (x <= x3)],
+                        [lambda x: (9 * np.square(x) * y3) / (4 * x3 ** 2),
+                         lambda x: -(y3 / 4) + (3 * x * y3) / (2 * x3),
+                         lambda x: -((5 * y3) / 4) - (9 * np.square(x) * y3) /
+                                   (4 * x3 ** 2) + (9 * x * y3) / (2 * x3)])
+
+
+def scurve(x, x3, y3):
+    # quintic smootherstep, zero slope and curvature at both ends
+    s = x / x3
+    return y3 * s ** 3 * (s * (6 * s - 15) + 10)
+
+
+def exponential(x, x3, y3, k=5.):
+    # first order approach, normalized to reach y3 at x3
+    return y3 * np.expm1(-k * x / x3) / np.expm1(-k)
+
+
+SHAPES = {'linear': linear, 'smooth': smooth, 'scurve': scurve, 'exponential': exponential}
+
+
+def trajectory(start, target, rate, dwell, shape='smooth'):
+    """Ramp from start to target (A) at an average rate (A/s), one point per dwell (s).
+
+    Returns (dwell, points, times). Results are cached, the arrays are
+    read-only and shared between callers.
+    """
+    start = round(float(start), DECIMALS)
+    return _trajectory(start, float(target), float(rate), float(dwell), shape)
+
+
+@lru_cache(maxsize=64)
+def _trajectory(start, target, rate, dwell, shape):
+    y3 = abs(start - target)
+    x3 = y3 / rate  # ramp time
+    reso = x3 / dwell
+
+    x = np.linspace(0, x3, int(reso))
+    y = SHAPES[shape](x, x3, y3) if len(x) else x
+    y = y.round(decimals=DECIMALS)
+    if target < start:
+        y = start - y
+    else:
+        y = start + y
+
+    times = np.linspace(0, dwell * len(x), len(x))
+    return dwell, readonly(y), readonly(times)
+
+
+def coordinated(starts, targets, rate, dwell, shape='smooth'):
+    """One schedule for several channels, e.g. both coils of a Helmholtz pair.
+
+    All channels follow the same shape and arrive together, the channel with
+    the largest step ramps at the average rate (A/s), the others slower.
+    Returns (dwell, points, times) with one column of points per channel.
+    """
+    starts = np.asarray(starts, dtype=float).round(decimals=DECIMALS)
+    spans = np.asarray(targets, dtype=float) - starts
+    x3 = np.abs(spans).max() / rate
+    x = np.linspace(0, x3, int(x3 / dwell))
+    progress = SHAPES[shape](x, x3, 1.) if len(x) else x
+    points = (starts + progress[:, None] * spans).round(decimals=DECIMALS)
+    times = np.linspace(0, dwell * len(x), len(x))
+    return dwell, points, times
+
+
+def breakpoints(times, currents, dwell):
+    """Piecewise linear trajectory through (time, current) breakpoints, sampled every dwell"""
+    times = np.asarray(times, dtype=float)
+    currents = np.asarray(currents, dtype=float)
+    if len(times) != len(currents) or len(times) < 2 or np.any(np.diff(times) < 0):
+        raise ValueError('need at least two breakpoints with ascending times')
+    t = np.arange(times[0], times[-1] + dwell / 2, dwell)
+    y = np.interp(t, times, currents).round(decimals=DECIMALS)
+    return dwell, y, t - times[0]
+
+
+def compress(points, dwell, tolerance=0.):
+    """Turn a trajectory into (setpoints, holds) with one write per distinct setpoint.
+
+    Consecutive identical setpoints collapse into one write held for the sum
+    of their dwells, so the delivered current profile is unchanged. With a
+    tolerance > 0 a new setpoint is only written once the trajectory has moved
+    more than tolerance away from the last written one, which bounds the
+    deviation from the full trajectory by tolerance. points may have one
+    column per channel (see coordinated), a row then counts as changed when
+    any of its channels changes.
+    """
+    points = np.asarray(points, dtype=float)
+    n = len(points)
+    if n == 0:
+        return points, np.zeros(0)
+    if tolerance > 0:
+        keep = deadband(points, tolerance)
+    else:
+        keep = np.flatnonzero(np.any(np.diff(points, axis=0).reshape(n - 1, points[0].size) != 0, axis=1)) + 1
+        keep = np.concatenate(([0], keep))
+    holds = np.diff(np.append(keep, n)) * dwell
+    return points[keep], holds
+
+
+def deadband(points, tolerance):
+    # indices of the points that leave the band around the last kept point, plus both ends
+    keep = [0]
+    last = points[0]
+    for i in range(1, len(points)):
+        if np.any(np.abs(points[i] - last) > tolerance):
+            keep.append(i)
+            last = points[i]
+    if np.any(points[-1] != last):
+        keep.append(len(points) - 1)
+    return np.asarray(keep)
+
+
+def readonly(a):
+    a.flags.writeable = False
+    return a